@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import sys
+import time
+
+log = logging.getLogger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# the value of the CircuitState metric per state
+state_values = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(ValueError):
+    pass
+
+
+class Circuit(object):
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+
+
+class CircuitBreaker(object):
+    """
+    keeps a circuit per database endpoint. After `threshold` consecutive connect failures, the
+    circuit opens and connects to the endpoint fail immediately. After `cooldown` seconds, the
+    circuit is half-open: the next connect is attempted, and closes the circuit when it succeeds
+    or opens it again when it fails.
+    """
+
+    def __init__(self, threshold=3, cooldown=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.circuits = {}
+
+    def state(self, endpoint):
+        circuit = self.circuits.get(endpoint)
+        return circuit.state if circuit else CLOSED
+
+    def before_connect(self, endpoint):
+        circuit = self.circuits.get(endpoint)
+        if circuit is None or circuit.state == CLOSED or self.threshold <= 0:
+            return
+
+        remaining = circuit.opened_at + self.cooldown - self.clock()
+        if circuit.state == OPEN and remaining <= 0:
+            self.transition(endpoint, circuit, HALF_OPEN)
+            return
+
+        if circuit.state == OPEN:
+            emit_metrics(endpoint, RejectedConnects=1)
+            raise CircuitOpenError(
+                "%s is unreachable, not connecting for another %.0fs after %d failures, %s"
+                % (endpoint, remaining, circuit.failures, circuit.last_error)
+            )
+
+    def on_success(self, endpoint):
+        circuit = self.circuits.pop(endpoint, None)
+        if circuit is not None and circuit.state != CLOSED:
+            self.transition(endpoint, circuit, CLOSED)
+
+    def on_failure(self, endpoint, error):
+        circuit = self.circuits.setdefault(endpoint, Circuit())
+        circuit.failures += 1
+        circuit.last_error = str(error).strip()
+        emit_metrics(endpoint, ConnectFailures=1)
+        if self.threshold > 0 and (circuit.state == HALF_OPEN or circuit.failures >= self.threshold):
+            circuit.opened_at = self.clock()
+            if circuit.state != OPEN:
+                self.transition(endpoint, circuit, OPEN)
+
+    def transition(self, endpoint, circuit, state):
+        log.warning("circuit of %s is %s, after %d connect failures", endpoint, state, circuit.failures)
+        circuit.state = state
+        emit_metrics(endpoint, CircuitState=state_values[state])
+
+
+def emit_metrics(endpoint, **metrics):
+    # writes the metrics in the CloudWatch embedded metric format to the log
+    units = {"CircuitState": "None"}
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": metrics_namespace,
+                    "Dimensions": [["Endpoint"]],
+                    "Metrics": [{"Name": name, "Unit": units.get(name, "Count")} for name in metrics],
+                }
+            ],
+        },
+        "Endpoint": endpoint,
+    }
+    record.update(metrics)
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+
+metrics_namespace = os.getenv("METRICS_NAMESPACE", "cfn-postgresql-user-provider")
+
+breaker = CircuitBreaker(
+    int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "3")), int(os.getenv("CIRCUIT_BREAKER_COOLDOWN", "30"))
+)
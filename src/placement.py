@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import time
+from collections import namedtuple
+
+import warmup
+
+log = logging.getLogger()
+
+Load = namedtuple("Load", ["databases", "size", "connections"])
+
+load_query = """
+SELECT (SELECT count(*) FROM pg_catalog.pg_database WHERE NOT datistemplate),
+       (SELECT coalesce(sum(pg_catalog.pg_database_size(oid)), 0) FROM pg_catalog.pg_database
+         WHERE NOT datistemplate AND datallowconn AND pg_catalog.has_database_privilege(oid, 'CONNECT')),
+       (SELECT count(*) FROM pg_catalog.pg_stat_activity
+         WHERE state = 'active' AND pid <> pg_catalog.pg_backend_pid())
+"""
+
+
+class LoadSamples(object):
+    """
+    caches the load of the candidate clusters for `ttl` seconds.
+    """
+
+    def __init__(self, ttl=30, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+
+    def get(self, key, sampler):
+        entry = self.entries.get(key)
+        if entry is not None and self.clock() < entry[1]:
+            return entry[0]
+
+        load = sampler()
+        self.entries[key] = (load, self.clock() + self.ttl)
+        return load
+
+    def add_database(self, key):
+        # counts a placed database, until the cluster is sampled again
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries[key] = (entry[0]._replace(databases=entry[0].databases + 1), entry[1])
+
+
+samples = LoadSamples(int(os.getenv("PLACEMENT_SAMPLE_TTL", "30")))
+
+
+def target_of(database):
+    # the host, port and database name of a connection target
+    return ",".join(warmup.hosts_of(database["Host"])), database.get("Port", 5432), database["DBName"]
+
+
+def sample(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(load_query)
+        return Load(*[int(v) for v in cursor.fetchone()])
+
+
+def choose(candidates, loads, tenant):
+    """
+    returns the candidate with the least load. The load of a candidate is the sum of its database count,
+    total database size and active connections, each relative to the largest among the candidates.
+    Candidates with the same load are ordered by a stable hash of the tenant and the target, so that
+    tenants are spread evenly over equally loaded clusters.
+    """
+    sampled = [c for c in candidates if target_of(c) in loads]
+    maxima = [max(loads[target_of(c)][i] for c in sampled) or 1 for i in range(len(Load._fields))]
+
+    def rank(candidate):
+        target = target_of(candidate)
+        load = sum(float(value) / maximum for value, maximum in zip(loads[target], maxima))
+        tie_break = hashlib.sha256(("%s:%s:%s:%s" % ((tenant,) + target)).encode("utf-8")).hexdigest()
+        return round(load, 2), tie_break
+
+    return min(sampled, key=rank)
+
+
+def place(candidates, tenant, connect):
+    """
+    samples the load of the `candidates`, and returns the least loaded one for the `tenant`. `connect`
+    returns a connection to a candidate. Candidates which cannot be sampled are skipped.
+    """
+    loads, errors = {}, []
+    for candidate in candidates:
+        target = target_of(candidate)
+
+        def sampler():
+            connection = connect(candidate)
+            try:
+                return sample(connection)
+            finally:
+                connection.close()
+
+        try:
+            loads[target] = samples.get(target, sampler)
+            log.info("load of %s:%s/%s is %s", target[0], target[1], target[2], loads[target])
+        except Exception as e:
+            log.warning("failed to sample the load of %s:%s/%s, %s", target[0], target[1], target[2], e)
+            errors.append("%s, %s" % (target[0], e))
+
+    if not loads:
+        raise ValueError("none of the candidates could be sampled, %s" % "; ".join(errors))
+
+    chosen = choose(candidates, loads, tenant)
+    samples.add_database(target_of(chosen))
+    log.info("placing %s on %s:%s/%s", tenant, *target_of(chosen))
+    return chosen
@@ -1,8 +1,12 @@
 import os
 import logging
 import postgresql_schema_provider
+import postgresql_extension_provider
 import postgresql_role_grant_provider
 import postgresql_user_provider
+import warmup
+
+warmup.prefetch(postgresql_user_provider.provider.ssm, postgresql_user_provider.provider.rds)
 
 
 def handler(request, context):
@@ -11,6 +15,8 @@ def handler(request, context):
         return postgresql_schema_provider.handler(request, context)
     elif request['ResourceType'] == 'Custom::PostgreSQLRoleGrant':
         return postgresql_role_grant_provider.handler(request, context)
+    elif request['ResourceType'] == 'Custom::PostgreSQLExtension':
+        return postgresql_extension_provider.handler(request, context)
 
     else:
         return postgresql_user_provider.handler(request, context)
@@ -0,0 +1,243 @@
+import logging
+
+from postgresql_user_provider import PostgreSQLUser
+from psycopg2.extensions import AsIs
+
+log = logging.getLogger()
+
+request_schema = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "object",
+    "oneOf": [{"required": ["Database", "Extensions"]}],
+    "properties": {
+        "Database": {"$ref": "#/definitions/connection"},
+        "Extensions": {
+            "type": "array",
+            "minItems": 1,
+            "items": {"$ref": "#/definitions/extension"},
+            "description": "to enable in the database",
+        },
+        "DeletionPolicy": {
+            "type": "string",
+            "default": "Retain",
+            "enum": ["Drop", "Retain"],
+        },
+    },
+    "definitions": {
+        "extension": {
+            "type": "object",
+            "required": ["Name"],
+            "properties": {
+                "Name": {
+                    "type": "string",
+                    "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
+                    "description": "of the extension",
+                },
+                "Schema": {
+                    "type": "string",
+                    "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
+                    "description": "to install the objects of the extension in",
+                },
+                "Version": {
+                    "type": ["string", "number"],
+                    "description": "of the extension to install",
+                },
+            },
+        },
+        "connection": {
+            "type": "object",
+            "oneOf": [
+                {"required": ["DBName", "Host", "Port", "User", "Password"]},
+                {
+                    "required": [
+                        "DBName",
+                        "Host",
+                        "Port",
+                        "User",
+                        "PasswordParameterName",
+                    ]
+                },
+                {
+                    "required": ["DBName", "Host", "Port", "User", "IamAuth"],
+                    "properties": {"IamAuth": {"enum": [True]}},
+                },
+            ],
+            # statements which cannot run through the pooler need the host of the database itself
+            "anyOf": [{"properties": {"Pooler": {"enum": [False]}}}, {"required": ["DirectHost"]}],
+            "properties": {
+                "DBName": {"type": "string", "description": "the name of the database"},
+                "Host": {
+                    "type": ["string", "array"],
+                    "items": {"type": "string"},
+                    "description": "the host of the database, or the hosts of the cluster of which the primary is used",
+                },
+                "Port": {
+                    "type": "integer",
+                    "default": 5432,
+                    "description": "the network port of the database",
+                },
+                "User": {
+                    "type": "string",
+                    "description": "the username of the database owner",
+                },
+                "Password": {
+                    "type": "string",
+                    "description": "the password of the database owner",
+                },
+                "PasswordParameterName": {
+                    "type": "string",
+                    "description": "the name of the database owner password in the Parameter Store.",
+                },
+                "IamAuth": {
+                    "type": "boolean",
+                    "description": "connect as the database owner with an RDS IAM authentication token",
+                },
+                "Pooler": {
+                    "type": "boolean",
+                    "description": "the host is a transaction pooler like PgBouncer or RDS Proxy",
+                },
+                "DirectHost": {
+                    "type": "string",
+                    "description": "the host of the database, bypassing the pooler",
+                },
+                "DirectPort": {
+                    "type": "integer",
+                    "description": "the network port of the database, bypassing the pooler",
+                },
+                "LockTimeout": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "the maximum number of milliseconds a statement may wait for a lock",
+                },
+                "LockWaitBudget": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "the maximum number of seconds to retry statements which could not obtain a lock",
+                },
+            },
+        },
+    },
+}
+
+
+class PostgreSQLExtension(PostgreSQLUser):
+    def __init__(self):
+        super(PostgreSQLExtension, self).__init__()
+        self.request_schema = request_schema
+        self.installed = {}
+
+    def is_supported_resource_type(self):
+        return self.resource_type == "Custom::PostgreSQLExtension"
+
+    @property
+    def extensions(self):
+        return self.get("Extensions", [])
+
+    @property
+    def old_extensions(self):
+        return self.get_old("Extensions", self.extensions)
+
+    @property
+    def deletion_policy(self):
+        return self.get("DeletionPolicy")
+
+    @property
+    def url(self):
+        return "extension:%s:%s" % (self.dbname, self.logical_resource_id)
+
+    def connect(self):
+        super(PostgreSQLExtension, self).connect()
+        # all extensions are enabled in a single transaction, committed or rolled back by close()
+        self.connection.autocommit = False
+
+    def load_installed_extensions(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT e.extname, n.nspname, e.extversion FROM pg_catalog.pg_extension e "
+                "JOIN pg_catalog.pg_namespace n ON n.oid = e.extnamespace"
+            )
+            self.installed = {name: (schema, version) for name, schema, version in cursor.fetchall()}
+
+    def create_extension(self, extension):
+        name, schema, version = extension["Name"], extension.get("Schema"), extension.get("Version")
+        log.info("create extension %s", name)
+        statement, args = "CREATE EXTENSION %s", [AsIs(name)]
+        if schema:
+            statement, args = statement + " SCHEMA %s", args + [AsIs(schema)]
+        if version is not None:
+            statement, args = statement + " VERSION %s", args + [str(version)]
+        self.execute_statement(statement, args)
+
+    def update_extension(self, extension):
+        name, schema, version = extension["Name"], extension.get("Schema"), extension.get("Version")
+        installed_schema, installed_version = self.installed[name]
+        if version is not None and str(version) != installed_version:
+            log.info("alter extension %s update to %s", name, version)
+            self.execute_statement("ALTER EXTENSION %s UPDATE TO %s", [AsIs(name), str(version)])
+        if schema and schema != installed_schema:
+            log.info("alter extension %s set schema %s", name, schema)
+            self.execute_statement("ALTER EXTENSION %s SET SCHEMA %s", [AsIs(name), AsIs(schema)])
+
+    def drop_extension(self, name):
+        log.info("drop extension %s", name)
+        self.execute_statement("DROP EXTENSION %s", [AsIs(name)])
+
+    def enable_extensions(self):
+        self.load_installed_extensions()
+        for extension in self.extensions:
+            if extension["Name"] in self.installed:
+                self.update_extension(extension)
+            else:
+                self.create_extension(extension)
+
+    def drop_extensions(self, extensions):
+        if self.deletion_policy != "Drop":
+            log.info("not dropping extensions %s", ", ".join(e["Name"] for e in extensions))
+            return
+
+        for extension in reversed(extensions):
+            if extension["Name"] in self.installed:
+                self.drop_extension(extension["Name"])
+
+    def create(self):
+        try:
+            self.connect()
+            self.enable_extensions()
+            self.physical_resource_id = self.url
+        except Exception as e:
+            self.physical_resource_id = "could-not-create"
+            self.fail("Failed to create extensions, %s" % e)
+        finally:
+            self.close()
+
+    def update(self):
+        try:
+            self.connect()
+            self.enable_extensions()
+            names = set(e["Name"] for e in self.extensions)
+            self.drop_extensions([e for e in self.old_extensions if e["Name"] not in names])
+        except Exception as e:
+            self.fail("Failed to update extensions, %s" % e)
+        finally:
+            self.close()
+
+    def delete(self):
+        if self.physical_resource_id == "could-not-create":
+            self.success("extensions were never created")
+            return
+
+        try:
+            self.connect()
+            self.load_installed_extensions()
+            self.drop_extensions(self.extensions)
+        except Exception as e:
+            return self.fail("failed to drop extensions, %s" % e)
+        finally:
+            self.close()
+
+
+provider = PostgreSQLExtension()
+
+
+def handler(request, context):
+    return provider.handle(request, context)
@@ -2,13 +2,17 @@ import logging
 
 from postgresql_user_provider import PostgreSQLUser
 from psycopg2.extensions import AsIs
+from role_graph import RoleGraph
 
 log = logging.getLogger()
 
 request_schema = {
     "$schema": "http://json-schema.org/draft-04/schema#",
     "type": "object",
-    "oneOf": [{"required": ["Database", "Grantee", "Role"]}],
+    "oneOf": [
+        {"required": ["Database", "Grantee", "Role"]},
+        {"required": ["Database", "Memberships"]},
+    ],
     "properties": {
         "Database": {"$ref": "#/definitions/connection"},
         "Grantee": {
@@ -21,8 +25,29 @@ request_schema = {
             "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
             "description": "to grant",
         },
+        "Memberships": {
+            "type": "array",
+            "items": {"$ref": "#/definitions/membership"},
+            "description": "the role memberships to grant",
+        },
     },
     "definitions": {
+        "membership": {
+            "type": "object",
+            "required": ["Role", "Grantee"],
+            "properties": {
+                "Role": {
+                    "type": "string",
+                    "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
+                    "description": "to grant",
+                },
+                "Grantee": {
+                    "type": "string",
+                    "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
+                    "description": "to grant role to",
+                },
+            },
+        },
         "connection": {
             "type": "object",
             "oneOf": [
@@ -36,10 +61,20 @@ request_schema = {
                         "PasswordParameterName",
                     ]
                 },
+                {
+                    "required": ["DBName", "Host", "Port", "User", "IamAuth"],
+                    "properties": {"IamAuth": {"enum": [True]}},
+                },
             ],
+            # statements which cannot run through the pooler need the host of the database itself
+            "anyOf": [{"properties": {"Pooler": {"enum": [False]}}}, {"required": ["DirectHost"]}],
             "properties": {
                 "DBName": {"type": "string", "description": "the name of the database"},
-                "Host": {"type": "string", "description": "the host of the database"},
+                "Host": {
+                    "type": ["string", "array"],
+                    "items": {"type": "string"},
+                    "description": "the host of the database, or the hosts of the cluster of which the primary is used",
+                },
                 "Port": {
                     "type": "integer",
                     "default": 5432,
@@ -57,6 +92,32 @@ request_schema = {
                     "type": "string",
                     "description": "the name of the database owner password in the Parameter Store.",
                 },
+                "IamAuth": {
+                    "type": "boolean",
+                    "description": "connect as the database owner with an RDS IAM authentication token",
+                },
+                "Pooler": {
+                    "type": "boolean",
+                    "description": "the host is a transaction pooler like PgBouncer or RDS Proxy",
+                },
+                "DirectHost": {
+                    "type": "string",
+                    "description": "the host of the database, bypassing the pooler",
+                },
+                "DirectPort": {
+                    "type": "integer",
+                    "description": "the network port of the database, bypassing the pooler",
+                },
+                "LockTimeout": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "the maximum number of milliseconds a statement may wait for a lock",
+                },
+                "LockWaitBudget": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "the maximum number of seconds to retry statements which could not obtain a lock",
+                },
             },
         }
     },
@@ -79,16 +140,60 @@ class PostgreSQLRoleGrant(PostgreSQLUser):
     def role(self):
         return self.get("Role")
 
-    def grant_role(self):
-        log.info("grant role %s to %s", self.role, self.grantee)
+    @staticmethod
+    def memberships_of(properties):
+        if "Memberships" in properties:
+            return {(m["Role"], m["Grantee"]) for m in properties["Memberships"]}
+        if "Role" in properties and "Grantee" in properties:
+            return {(properties["Role"], properties["Grantee"])}
+        return set()
+
+    @property
+    def memberships(self):
+        return self.memberships_of(self.properties)
+
+    @property
+    def changes_form(self):
+        # true if an update switches between a single Role and Grantee and a list of Memberships
+        return self.request_type == "Update" and ("Memberships" in self.properties) != (
+            "Memberships" in self.old_properties
+        )
+
+    @property
+    def old_memberships(self):
+        # a changed single grant gets a new physical resource id, and the old one is deleted
+        if self.request_type != "Update" or ("Memberships" not in self.properties and not self.changes_form):
+            return set()
+        return self.memberships_of(self.old_properties)
+
+    def load_role_graph(self):
         with self.connection.cursor() as cursor:
-            cursor.execute("GRANT %s to %s", [AsIs(self.role), AsIs(self.grantee)])
-        self.physical_resource_id = f"grant:{self.dbname}:{self.role}:{self.grantee}"
+            return RoleGraph.load(cursor)
+
+    def apply(self, desired, managed):
+        graph = self.load_role_graph()
+        grants, revokes = graph.plan(desired, managed)
+        for role, grantee in grants:
+            log.info("grant role %s to %s", role, grantee)
+            self.execute_statement("GRANT %s to %s", [AsIs(role), AsIs(grantee)])
+        for role, grantee in revokes:
+            log.info("revoke role %s from %s", role, grantee)
+            self.execute_statement("REVOKE %s FROM %s", [AsIs(role), AsIs(grantee)])
+        log.info("granted %d and revoked %d of %d memberships", len(grants), len(revokes), len(desired))
+
+    def grant_role(self):
+        self.apply(self.memberships, self.old_memberships)
+        if self.changes_form:
+            # a new physical resource id would make CloudFormation delete the old one, revoking memberships
+            # which are still declared. The memberships which are no longer declared were revoked above.
+            return
+        if "Memberships" in self.properties:
+            self.physical_resource_id = f"grants:{self.dbname}:{self.logical_resource_id}"
+        else:
+            self.physical_resource_id = f"grant:{self.dbname}:{self.role}:{self.grantee}"
 
     def revoke_role(self):
-        log.info("revoke role %s from %s", self.role, self.grantee)
-        with self.connection.cursor() as cursor:
-            cursor.execute("REVOKE %s FROM %s", [AsIs(self.role), AsIs(self.grantee)])
+        self.apply(set(), self.memberships)
 
     def create(self):
         try:
@@ -118,7 +223,7 @@ class PostgreSQLRoleGrant(PostgreSQLUser):
             self.connect()
             self.revoke_role()
         except Exception as e:
-            return self.fail("failed to revoke role %s", e)
+            return self.fail("failed to revoke role %s" % e)
         finally:
             self.close()
 
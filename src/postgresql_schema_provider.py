@@ -1,10 +1,55 @@
+import json
 import logging
+import time
 
+import boto3
+import seed
 from postgresql_user_provider import PostgreSQLUser
 from psycopg2.extensions import AsIs
 
 log = logging.getLogger()
 
+# the maximum number of times an ownership transfer continues in a new invocation
+max_ownership_transfer_invocations = 20
+
+# lists the statements to transfer the ownership of the objects in the schema, which are
+# not owned by the new owner. Objects owned by an extension, and sequences owned by a
+# table, change owner with their extension or table.
+ownership_transfer_query = """
+SELECT format('ALTER %%s %%I.%%I OWNER TO %%s',
+              CASE c.relkind WHEN 'v' THEN 'VIEW' WHEN 'm' THEN 'MATERIALIZED VIEW' WHEN 'S' THEN 'SEQUENCE'
+                             WHEN 'f' THEN 'FOREIGN TABLE' ELSE 'TABLE' END,
+              n.nspname, c.relname, %(owner)s)
+  FROM pg_catalog.pg_class c
+  JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+ WHERE n.nspname = %(schema)s
+   AND c.relkind IN ('r', 'p', 'v', 'm', 'S', 'f')
+   AND c.relowner = %(old_owner)s::regrole
+   AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_depend d
+                    WHERE d.classid = 'pg_catalog.pg_class'::regclass AND d.objid = c.oid AND d.deptype IN ('a', 'i', 'e'))
+UNION ALL
+SELECT format('ALTER %%s %%s OWNER TO %%s',
+              CASE p.prokind WHEN 'a' THEN 'AGGREGATE' WHEN 'p' THEN 'PROCEDURE' ELSE 'FUNCTION' END,
+              p.oid::regprocedure, %(owner)s)
+  FROM pg_catalog.pg_proc p
+  JOIN pg_catalog.pg_namespace n ON n.oid = p.pronamespace
+ WHERE n.nspname = %(schema)s
+   AND p.proowner = %(old_owner)s::regrole
+   AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_depend d
+                    WHERE d.classid = 'pg_catalog.pg_proc'::regclass AND d.objid = p.oid AND d.deptype = 'e')
+UNION ALL
+SELECT format('ALTER %%s %%I.%%I OWNER TO %%s',
+              CASE t.typtype WHEN 'd' THEN 'DOMAIN' ELSE 'TYPE' END, n.nspname, t.typname, %(owner)s)
+  FROM pg_catalog.pg_type t
+  JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
+ WHERE n.nspname = %(schema)s
+   AND (t.typtype IN ('d', 'e', 'r')
+        OR t.typtype = 'c' AND (SELECT c.relkind FROM pg_catalog.pg_class c WHERE c.oid = t.typrelid) = 'c')
+   AND t.typowner = %(old_owner)s::regrole
+   AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_depend d
+                    WHERE d.classid = 'pg_catalog.pg_type'::regclass AND d.objid = t.oid AND d.deptype = 'e')
+"""
+
 request_schema = {
     "$schema": "http://json-schema.org/draft-04/schema#",
     "type": "object",
@@ -26,6 +71,18 @@ request_schema = {
             "default": "Retain",
             "enum": ["Drop", "Retain"],
         },
+        "Seed": seed.seed_schema,
+        "TransferOwnership": {
+            "type": "boolean",
+            "default": False,
+            "description": "transfer the ownership of all objects in the schema to the owner",
+        },
+        "OwnershipBatchSize": {
+            "type": "integer",
+            "default": 500,
+            "minimum": 1,
+            "description": "the number of objects to transfer the ownership of in a single transaction",
+        },
     },
     "definitions": {
         "connection": {
@@ -41,10 +98,20 @@ request_schema = {
                         "PasswordParameterName",
                     ]
                 },
+                {
+                    "required": ["DBName", "Host", "Port", "User", "IamAuth"],
+                    "properties": {"IamAuth": {"enum": [True]}},
+                },
             ],
+            # statements which cannot run through the pooler need the host of the database itself
+            "anyOf": [{"properties": {"Pooler": {"enum": [False]}}}, {"required": ["DirectHost"]}],
             "properties": {
                 "DBName": {"type": "string", "description": "the name of the database"},
-                "Host": {"type": "string", "description": "the host of the database"},
+                "Host": {
+                    "type": ["string", "array"],
+                    "items": {"type": "string"},
+                    "description": "the host of the database, or the hosts of the cluster of which the primary is used",
+                },
                 "Port": {
                     "type": "integer",
                     "default": 5432,
@@ -62,6 +129,32 @@ request_schema = {
                     "type": "string",
                     "description": "the name of the database owner password in the Parameter Store.",
                 },
+                "IamAuth": {
+                    "type": "boolean",
+                    "description": "connect as the database owner with an RDS IAM authentication token",
+                },
+                "Pooler": {
+                    "type": "boolean",
+                    "description": "the host is a transaction pooler like PgBouncer or RDS Proxy",
+                },
+                "DirectHost": {
+                    "type": "string",
+                    "description": "the host of the database, bypassing the pooler",
+                },
+                "DirectPort": {
+                    "type": "integer",
+                    "description": "the network port of the database, bypassing the pooler",
+                },
+                "LockTimeout": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "the maximum number of milliseconds a statement may wait for a lock",
+                },
+                "LockWaitBudget": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "the maximum number of seconds to retry statements which could not obtain a lock",
+                },
             },
         }
     },
@@ -96,43 +189,112 @@ class PostgreSQLSchema(PostgreSQLUser):
     def deletion_policy(self):
         return self.get("DeletionPolicy")
 
+    @property
+    def transfer_ownership(self):
+        return self.get("TransferOwnership")
+
+    @property
+    def ownership_batch_size(self):
+        return self.get("OwnershipBatchSize")
+
+    @property
+    def ownership_transfer_invocation(self):
+        # the number of times the ownership transfer of this request continued in a new invocation
+        return self.request.get("OwnershipTransferInvocation", 0)
+
+    @property
+    def lambda_client(self):
+        if not hasattr(self, "_lambda_client"):
+            self._lambda_client = boto3.client("lambda")
+        return self._lambda_client
+
     def create_schema(self):
         log.info("create schema %s ", self.schema)
-        with self.connection.cursor() as cursor:
-            if self.owner != self.dbowner:
-                cursor.execute("GRANT %s to %s", [AsIs(self.owner), AsIs(self.dbowner)])
-            cursor.execute(
-                "CREATE SCHEMA %s AUTHORIZATION %s",
-                [AsIs(self.schema), AsIs(self.owner)],
-            )
+        if self.owner != self.dbowner:
+            self.execute_statement("GRANT %s to %s", [AsIs(self.owner), AsIs(self.dbowner)])
+        self.execute_statement(
+            "CREATE SCHEMA %s AUTHORIZATION %s",
+            [AsIs(self.schema), AsIs(self.owner)],
+        )
 
     def drop_schema(self):
         if self.deletion_policy == "Drop":
             log.info("drop schema %s ", self.schema)
-            with self.connection.cursor() as cursor:
-                cursor.execute("DROP SCHEMA %s CASCADE", [AsIs(self.schema)])
+            self.execute_statement("DROP SCHEMA %s CASCADE", [AsIs(self.schema)])
+
+    def list_ownership_transfers(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                ownership_transfer_query, {"schema": self.schema, "owner": self.owner, "old_owner": self.old_owner}
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def remaining_time(self):
+        # the remaining execution time of the lambda in seconds
+        if hasattr(self.context, "get_remaining_time_in_millis"):
+            return self.context.get_remaining_time_in_millis() / 1000.0
+        return float("inf")
+
+    def continue_in_new_invocation(self):
+        if self.ownership_transfer_invocation >= max_ownership_transfer_invocations:
+            raise ValueError("ownership transfer did not complete in %d invocations" % max_ownership_transfer_invocations)
+
+        request = dict(self.request, OwnershipTransferInvocation=self.ownership_transfer_invocation + 1)
+        self.lambda_client.invoke(
+            FunctionName=self.context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(request).encode("utf-8"),
+        )
+        # the new invocation sends the response
+        self.asynchronous = True
+
+    def transfer_ownership_of_objects(self):
+        for role in {self.owner, self.old_owner} - {self.dbowner}:
+            self.execute_statement("GRANT %s to %s", [AsIs(role), AsIs(self.dbowner)])
+
+        statements = self.list_ownership_transfers()
+        log.info("transfer ownership of %d objects in schema %s to %s", len(statements), self.schema, self.owner)
+        slowest = 0.0
+        for i in range(0, len(statements), self.ownership_batch_size):
+            if self.remaining_time() < 2 * slowest + 10:
+                log.info("continue ownership transfer of %d objects in a new invocation", len(statements) - i)
+                self.continue_in_new_invocation()
+                return
+
+            started = time.monotonic()
+            self.execute_statement("; ".join(statements[i : i + self.ownership_batch_size]))
+            slowest = max(slowest, time.monotonic() - started)
 
     def update_schema(self):
+        if self.ownership_transfer_invocation:
+            # the schema itself was updated by the first invocation
+            if self.owner != self.old_owner:
+                self.transfer_ownership_of_objects()
+            return
+
         if self.owner != self.old_owner:
             log.info("alter schema %s owner to %s", self.old_schema, self.owner)
-            with self.connection.cursor() as cursor:
-                cursor.execute(
-                    "ALTER SCHEMA %s OWNER TO %s",
-                    [AsIs(self.old_schema), AsIs(self.owner)],
-                )
+            self.execute_statement(
+                "ALTER SCHEMA %s OWNER TO %s",
+                [AsIs(self.old_schema), AsIs(self.owner)],
+            )
 
         if self.schema != self.old_schema:
             log.info("alter schema %s rename to %s", self.old_schema, self.schema)
-            with self.connection.cursor() as cursor:
-                cursor.execute(
-                    "ALTER SCHEMA %s RENAME TO %s",
-                    [AsIs(self.old_schema), AsIs(self.schema)],
-                )
+            self.execute_statement(
+                "ALTER SCHEMA %s RENAME TO %s",
+                [AsIs(self.old_schema), AsIs(self.schema)],
+            )
+
+        # altering the owner of an object locks it, even if the owner is unchanged
+        if self.transfer_ownership and self.owner != self.old_owner:
+            self.transfer_ownership_of_objects()
 
     def create(self):
         try:
             self.connect()
             self.create_schema()
+            self.seed_database(self.dbname, self.owner, self.schema)
             self.physical_resource_id = self.logical_resource_id
         except Exception as e:
             self.physical_resource_id = "could-not-create"
@@ -144,6 +306,8 @@ class PostgreSQLSchema(PostgreSQLUser):
         try:
             self.connect()
             self.update_schema()
+            if not self.asynchronous:
+                self.seed_database(self.dbname, self.owner, self.schema)
         except Exception as e:
             self.fail("Failed to update the schema, %s" % e)
         finally:
@@ -158,7 +322,7 @@ class PostgreSQLSchema(PostgreSQLUser):
             self.connect()
             self.drop_schema()
         except Exception as e:
-            return self.fail("failed to drop schema %s", e)
+            return self.fail("failed to drop schema %s" % e)
         finally:
             self.close()
 
@@ -1,21 +1,51 @@
 import boto3
 import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 from botocore.exceptions import ClientError
 from psycopg2.extensions import AsIs
 from cfn_resource_provider import ResourceProvider
 
+import circuit_breaker
+import placement
+import response_cache
+import scram
+import seed
+import warmup
+
 log = logging.getLogger()
 
+# RDS IAM authentication tokens are valid for 15 minutes, refresh them a minute before.
+iam_token_lifetime = 15 * 60
+iam_token_refresh_margin = 60
+
+# the cluster wide lock wait policy, which can be overridden per resource: every DDL statement waits at most
+# `lock_timeout` milliseconds for a lock, and is retried until `lock_wait_budget` seconds have passed.
+lock_timeout = int(os.getenv('LOCK_TIMEOUT', '1000'))
+lock_wait_budget = int(os.getenv('LOCK_WAIT_BUDGET', '20'))
+
 request_schema = {
     "$schema": "http://json-schema.org/draft-04/schema#",
     "type": "object",
     "oneOf": [
-        {"required": ["Database", "User", "Password"]},
-        {"required": ["Database", "User", "PasswordParameterName"]}
+        {"required": ["User", "Password"]},
+        {"required": ["User", "PasswordParameterName"]}
+    ],
+    "anyOf": [
+        {"required": ["Database"]},
+        {"required": ["Candidates"]}
     ],
     "properties": {
         "Database": {"$ref": "#/definitions/connection"},
+        "Candidates": {
+            "type": "array",
+            "minItems": 1,
+            "items": {"$ref": "#/definitions/connection"},
+            "description": "the databases to place the user on, when no Database is specified"
+        },
         "User": {
             "type": "string",
             "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
@@ -39,6 +69,44 @@ request_schema = {
             "type": "string",
             "default": "Retain",
             "enum": ["Drop", "Retain"]
+        },
+        "ReassignOwnedTo": {
+            "type": "string",
+            "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
+            "description": "the role to reassign the objects of the user to, before the user is dropped"
+        },
+        "Seed": seed.seed_schema,
+        "Parallelism": {
+            "type": "integer",
+            "minimum": 1,
+            "maximum": 16,
+            "default": 4,
+            "description": "the maximum number of databases to reassign the objects in at the same time"
+        },
+        "DatabaseSettings": {
+            "type": "object",
+            "default": {},
+            "patternProperties": {
+                "^[A-Za-z_][A-Za-z0-9_.]*$": {"type": ["string", "number", "boolean"]}
+            },
+            "additionalProperties": False,
+            "description": "configuration parameters to set on the database"
+        },
+        "Tablespace": {
+            "type": "string",
+            "pattern": "^[_A-Za-z][A-Za-z0-9_$]*$",
+            "description": "the tablespace to place the database in"
+        },
+        "TablespaceMoveTimeout": {
+            "type": "integer",
+            "minimum": 1,
+            "default": 600,
+            "description": "the maximum number of seconds a move of the database to another tablespace may take"
+        },
+        "PasswordIterations": {
+            "type": "integer",
+            "minimum": 1,
+            "description": "the iteration count of the SCRAM-SHA-256 verifier of the password, computed by the provider"
         }
     },
     "definitions": {
@@ -46,16 +114,21 @@ request_schema = {
             "type": "object",
             "oneOf": [
                 {"required": ["DBName", "Host", "Port", "User", "Password"]},
-                {"required": ["DBName", "Host", "Port", "User", "PasswordParameterName"]}
+                {"required": ["DBName", "Host", "Port", "User", "PasswordParameterName"]},
+                {"required": ["DBName", "Host", "Port", "User", "IamAuth"],
+                 "properties": {"IamAuth": {"enum": [True]}}}
             ],
+            # statements which cannot run through the pooler need the host of the database itself
+            "anyOf": [{"properties": {"Pooler": {"enum": [False]}}}, {"required": ["DirectHost"]}],
             "properties": {
                 "DBName": {
                     "type": "string",
                     "description": "the name of the database"
                 },
                 "Host": {
-                    "type": "string",
-                    "description": "the host of the database"
+                    "type": ["string", "array"],
+                    "items": {"type": "string"},
+                    "description": "the host of the database, or the hosts of the cluster of which the primary is used"
                 },
                 "Port": {
                     "type": "integer",
@@ -73,6 +146,32 @@ request_schema = {
                 "PasswordParameterName": {
                     "type": "string",
                     "description": "the name of the database owner password in the Parameter Store."
+                },
+                "IamAuth": {
+                    "type": "boolean",
+                    "description": "connect as the database owner with an RDS IAM authentication token"
+                },
+                "Pooler": {
+                    "type": "boolean",
+                    "description": "the host is a transaction pooler like PgBouncer or RDS Proxy"
+                },
+                "DirectHost": {
+                    "type": "string",
+                    "description": "the host of the database, bypassing the pooler"
+                },
+                "DirectPort": {
+                    "type": "integer",
+                    "description": "the network port of the database, bypassing the pooler"
+                },
+                "LockTimeout": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "description": "the maximum number of milliseconds a statement may wait for a lock"
+                },
+                "LockWaitBudget": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "description": "the maximum number of seconds to retry statements which could not obtain a lock"
                 }
             }
         }
@@ -80,12 +179,24 @@ request_schema = {
 }
 
 
+def setting_value(value):
+    # the value as it is stored in pg_db_role_setting
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
 class PostgreSQLUser(ResourceProvider):
 
     def __init__(self):
         super(PostgreSQLUser, self).__init__()
         self.ssm = boto3.client('ssm')
+        self.rds = boto3.client('rds')
+        self.iam_tokens = {}
         self.connection = None
+        self._direct_connection = None
+        self._database = None
+        self.lock_wait_deadline = 0
         self.request_schema = request_schema
 
     def convert_property_types(self):
@@ -105,33 +216,90 @@ class PostgreSQLUser(ResourceProvider):
         else:
             return self.get_password(self.get('PasswordParameterName'))
 
+    def get_iam_token(self, host, port, user=None):
+        user = user if user else self.dbowner
+        key = (host, port, user)
+        token, expires = self.iam_tokens.get(key, (None, 0))
+        if time.time() >= expires:
+            log.info('generating IAM authentication token for %s on %s', user, host)
+            token = self.rds.generate_db_auth_token(DBHostname=host, Port=port, DBUsername=user)
+            expires = time.time() + iam_token_lifetime - iam_token_refresh_margin
+            self.iam_tokens[key] = (token, expires)
+        return token
+
+    def password_of(self, database, host):
+        if database.get('IamAuth', False):
+            return self.get_iam_token(host, database.get('Port', 5432), database.get('User'))
+        elif 'Password' in database:
+            return database.get('Password')
+        else:
+            return warmup.secrets.get(database['PasswordParameterName'], self.get_password)
+
     @property
     def dbowner_password(self):
-        db = self.get('Database')
-        if 'Password' in db:
-            return db.get('Password')
-        else:
-            return self.get_password(db['PasswordParameterName'])
+        return self.password_of(self.database, self.primary_host)
+
+    def set_request(self, request, context):
+        super(PostgreSQLUser, self).set_request(request, context)
+        self._database = None
+
+    @property
+    def database(self):
+        # the connection information of the database owner, of the Database or the placement of the user
+        if self._database is None:
+            self._database = self.resolve_database()
+        return self._database
+
+    def resolve_database(self):
+        if 'Database' in self.properties or 'Candidates' not in self.properties:
+            return self.get('Database', {})
+
+        candidates = self.get('Candidates')
+        if self.request_type == 'Create':
+            return placement.place(candidates, self.user, self.connect_to_candidate)
+
+        # the database on which the user was placed is recorded in the physical resource id
+        parts = self.physical_resource_id.split(':') if self.physical_resource_id else []
+        if len(parts) == 6 and parts[0] == 'postgresql':
+            for candidate in candidates:
+                host, port, dbname = placement.target_of(candidate)
+                if warmup.same_hosts(host, parts[1]) and (port, dbname) == (int(parts[2]), parts[3]):
+                    return candidate
+            raise ValueError('%s:%s/%s is no longer one of the Candidates' % (parts[1], parts[2], parts[3]))
+        return {}
+
+    def connect_to_candidate(self, candidate):
+        return warmup.connect_primary(warmup.hosts_of(candidate['Host']),
+                                      lambda host: self.connect_info_of(host, candidate), self.connect_timeout)
 
     @property
     def user(self):
         return self.get('User')
 
+    @property
+    def hosts(self):
+        return warmup.hosts_of(self.database.get('Host', []))
+
     @property
     def host(self):
-        return self.get('Database', {}).get('Host', None)
+        return ','.join(self.hosts) if self.hosts else None
+
+    @property
+    def primary_host(self):
+        # the last known primary of the cluster, or the only host
+        return warmup.primaries.get(tuple(self.hosts), self.hosts[0])
 
     @property
     def port(self):
-        return self.get('Database', {}).get('Port', 5432)
+        return self.database.get('Port', 5432)
 
     @property
     def dbname(self):
-        return self.get('Database', {}).get('DBName', None)
+        return self.database.get('DBName', None)
 
     @property
     def dbowner(self):
-        return self.get('Database', {}).get('User', None)
+        return self.database.get('User', None)
 
     @property
     def with_database(self):
@@ -141,14 +309,100 @@ class PostgreSQLUser(ResourceProvider):
     def deletion_policy(self):
         return self.get('DeletionPolicy')
 
+    @property
+    def reassign_owned_to(self):
+        return self.get('ReassignOwnedTo')
+
+    @property
+    def password_iterations(self):
+        return self.get('PasswordIterations')
+
+    def encrypted_password(self, password):
+        # with PasswordIterations, only the SCRAM verifier of the password is sent to the server
+        if self.password_iterations:
+            return scram.verifier(password, self.password_iterations)
+        return password
+
+    @property
+    def seeds(self):
+        return self.get('Seed', [])
+
+    @property
+    def s3(self):
+        if not hasattr(self, '_s3'):
+            self._s3 = boto3.client('s3')
+        return self._s3
+
+    @property
+    def parallelism(self):
+        return self.get('Parallelism', 4)
+
+    @property
+    def database_settings(self):
+        return self.get('DatabaseSettings', {})
+
+    @property
+    def old_database_settings(self):
+        return self.get_old('DatabaseSettings', {})
+
+    @property
+    def tablespace(self):
+        return self.get('Tablespace')
+
+    @property
+    def tablespace_move_timeout(self):
+        return self.get('TablespaceMoveTimeout', 600)
+
+    @property
+    def iam_auth(self):
+        return self.database.get('IamAuth', False)
+
+    @property
+    def pooler(self):
+        return self.database.get('Pooler', False)
+
+    @property
+    def direct_host(self):
+        return self.database.get('DirectHost', self.primary_host)
+
+    @property
+    def direct_port(self):
+        return self.database.get('DirectPort', self.port)
+
+    @property
+    def lock_timeout(self):
+        return self.database.get('LockTimeout', lock_timeout)
+
+    @property
+    def lock_wait_budget(self):
+        return self.database.get('LockWaitBudget', lock_wait_budget)
+
     @property
     def connect_info(self):
-        return {'host': self.host, 'port': self.port, 'dbname': self.dbname,
-                'user': self.dbowner, 'password': self.dbowner_password}
+        return self.connect_info_of(self.primary_host)
+
+    def connect_info_of(self, host, database=None):
+        database = database if database is not None else self.database
+        result = {'host': host, 'port': database.get('Port', 5432), 'dbname': database.get('DBName'),
+                  'user': database.get('User'), 'password': self.password_of(database, host),
+                  'connect_timeout': self.connect_timeout}
+        if database.get('IamAuth', False):
+            # RDS only accepts IAM authentication over SSL
+            result['sslmode'] = 'require'
+        return result
+
+    @property
+    def direct_connect_info(self):
+        result = dict(self.connect_info, host=self.direct_host, port=self.direct_port)
+        if self.iam_auth:
+            result['password'] = self.get_iam_token(self.direct_host, self.direct_port)
+        return result
 
     @property
     def allow_update(self):
-        return self.url == self.physical_resource_id
+        # the hosts in the physical resource id may differ from the current list of hosts of the cluster
+        parts, url = (self.physical_resource_id or '').split(':'), self.url.split(':')
+        return len(parts) == len(url) and parts[2:] == url[2:] and warmup.same_hosts(parts[1], self.host)
 
     @property
     def url(self):
@@ -157,21 +411,135 @@ class PostgreSQLUser(ResourceProvider):
         else:
             return 'postgresql:%s:%s:%s::%s' % (self.host, self.port, self.dbname, self.user)
 
+    @property
+    def endpoint(self):
+        return '%s:%s' % (self.host, self.port)
+
+    @property
+    def connection_key(self):
+        return self.host, self.port, self.dbname, self.dbowner
+
+    def invalidate_cached_connect_info(self):
+        invalidated = False
+        for host in self.hosts:
+            invalidated = warmup.dns.invalidate(host) or invalidated
+        if 'PasswordParameterName' in self.database:
+            invalidated = warmup.secrets.invalidate(self.database['PasswordParameterName']) or invalidated
+        return invalidated
+
+    def connect_to_primary(self):
+        if len(self.hosts) == 1:
+            return warmup.connect_read_write(self.connect_info, self.connect_timeout)
+        return warmup.connect_primary(self.hosts, self.connect_info_of, self.connect_timeout)
+
+    def open_connection(self):
+        try:
+            return self.connect_to_primary()
+        except psycopg2.OperationalError as e:
+            # after a failover or a password rotation, the cached address or password is stale
+            if not self.invalidate_cached_connect_info():
+                raise
+            log.info('retrying connect to %s with a fresh address and password, %s', self.host, e)
+            return self.connect_to_primary()
+
     def connect(self):
+        self.lock_wait_deadline = time.time() + self.time_budget(self.lock_wait_budget) / 1000.0
+        self.connection = warmup.pool.take(self.connection_key)
+        if self.connection:
+            log.info('reusing connection to database %s on port %d as user %s', self.host, self.port, self.dbowner)
+            return
+
         log.info('connecting to database %s on port %d as user %s', self.host, self.port, self.dbowner)
         try:
-            self.connection = psycopg2.connect(**self.connect_info)
+            circuit_breaker.breaker.before_connect(self.endpoint)
+            try:
+                self.connection = self.open_connection()
+            except (psycopg2.OperationalError, OSError) as e:
+                circuit_breaker.breaker.on_failure(self.endpoint, e)
+                raise
+            circuit_breaker.breaker.on_success(self.endpoint)
             self.connection.set_session(autocommit=True)
         except Exception as e:
             raise ValueError('Failed to connect, %s' % e)
 
+    @property
+    def direct_connection(self):
+        # a connection bypassing the pooler, for statements which cannot run through a transaction pooler
+        if not self.pooler:
+            return self.connection
+
+        if not self._direct_connection:
+            log.info('connecting directly to database %s on port %d as user %s',
+                     self.direct_host, self.direct_port, self.dbowner)
+            try:
+                self._direct_connection = warmup.connect(self.direct_connect_info)
+                self._direct_connection.set_session(autocommit=True)
+            except Exception as e:
+                raise ValueError('Failed to connect directly, %s' % e)
+        return self._direct_connection
+
     def close(self):
+        if self._direct_connection:
+            self._direct_connection.close()
+            self._direct_connection = None
+
         if self.connection:
             if self.status == 'SUCCESS':
                 self.connection.commit()
+                # keep the connection open for the next invocation
+                warmup.pool.give(self.connection_key, self.connection)
             else:
                 self.connection.rollback()
-            self.connection.close()
+                self.connection.close()
+            self.connection = None
+
+    def execute_statement(self, statement, args=None, connection=None, transaction=True):
+        # executes a DDL statement under the lock wait policy: waiting at most `lock_timeout` for a lock,
+        # so that it never blocks live traffic for long, and retrying with backoff until the budget is spent.
+        if connection is None:
+            connection = self.connection
+        attempt = 0
+        while True:
+            try:
+                with connection.cursor() as cursor:
+                    self.execute_with_lock_timeout(cursor, statement, args, transaction)
+                return
+            except (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected) as e:
+                attempt += 1
+                delay = min(2.0, 0.1 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if time.time() + delay > self.lock_wait_deadline:
+                    raise ValueError('gave up waiting for locks after %d attempts, %s' % (attempt, str(e).strip()))
+                log.warning('lock not available, retrying in %.2fs, %s', delay, str(e).strip())
+                time.sleep(delay)
+
+    def execute_with_lock_timeout(self, cursor, statement, args, transaction):
+        args = list(args) if args is not None else []
+        if not args:
+            statement = statement.replace('%', '%%')
+        connection = cursor.connection
+
+        if not transaction:
+            # statements like CREATE DATABASE cannot run in a transaction block, use the session setting
+            cursor.execute('SET lock_timeout = %s', [self.lock_timeout])
+            try:
+                cursor.execute(statement, args)
+            finally:
+                cursor.execute('RESET lock_timeout')
+        elif connection.autocommit:
+            try:
+                cursor.execute('BEGIN; SET LOCAL lock_timeout = %s; ' + statement + '; COMMIT',
+                               [self.lock_timeout] + args)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        else:
+            # inside the transaction of the caller, retry from a savepoint
+            try:
+                cursor.execute('SAVEPOINT lock_wait; SET LOCAL lock_timeout = %s; ' + statement +
+                               '; RELEASE SAVEPOINT lock_wait', [self.lock_timeout] + args)
+            except Exception:
+                cursor.execute('ROLLBACK TO SAVEPOINT lock_wait')
+                raise
 
     def db_exists(self):
         with self.connection.cursor() as cursor:
@@ -187,57 +555,196 @@ class PostgreSQLUser(ResourceProvider):
             rows = cursor.fetchall()
             return len(rows) > 0
 
-    def drop_user(self):
+    @property
+    def connect_timeout(self):
+        # a connect gives up before the lambda is out of time, so that the failure reaches the circuit breaker
+        return max(1, int(self.time_budget(warmup.connect_timeout) / 1000))
+
+    def time_budget(self, seconds):
+        # the budget in milliseconds, never beyond the remaining execution time of the lambda
+        budget = seconds * 1000
+        if hasattr(self.context, 'get_remaining_time_in_millis'):
+            budget = min(budget, self.context.get_remaining_time_in_millis() - 5000)
+        return budget
+
+    def get_database_settings(self):
         with self.connection.cursor() as cursor:
-            if self.deletion_policy == 'Drop':
-                log.info('drop role  %s', self.user)
-                cursor.execute('DROP ROLE %s', [AsIs(self.user)])
-            else:
-                log.info('disable login of  %s', self.user)
-                cursor.execute("ALTER ROLE %s NOLOGIN", [AsIs(self.user)])
+            cursor.execute(
+                "SELECT unnest(s.setconfig) FROM pg_catalog.pg_db_role_setting s "
+                "JOIN pg_catalog.pg_database d ON d.oid = s.setdatabase "
+                "WHERE s.setrole = 0 AND d.datname = %s", [self.user])
+            return dict(row[0].split('=', 1) for row in cursor.fetchall())
+
+    def get_tablespace(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT t.spcname FROM pg_catalog.pg_database d "
+                "JOIN pg_catalog.pg_tablespace t ON t.oid = d.dattablespace "
+                "WHERE d.datname = %s", [self.user])
+            rows = cursor.fetchall()
+            return rows[0][0] if rows else None
+
+    def get_dependent_databases(self):
+        # the databases in which the user owns objects or has been granted privileges
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT d.datname FROM pg_catalog.pg_shdepend s "
+                "JOIN pg_catalog.pg_database d ON d.oid = s.dbid "
+                "WHERE s.refclassid = 'pg_catalog.pg_authid'::regclass AND d.datallowconn "
+                "AND s.refobjid = (SELECT oid FROM pg_catalog.pg_roles WHERE rolname = %s)", [self.user])
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def drop_owned_in_database(self, connect_info):
+        log.info('reassign objects owned by %s to %s in database %s', self.user, self.reassign_owned_to,
+                 connect_info['dbname'])
+        connection = warmup.connect(connect_info)
+        try:
+            connection.autocommit = True
+            self.execute_statement('REASSIGN OWNED BY %s TO %s; DROP OWNED BY %s', [
+                AsIs(self.user), AsIs(self.reassign_owned_to), AsIs(self.user)], connection=connection)
+        finally:
+            connection.close()
+
+    def drop_owned(self):
+        self.execute_statement('GRANT %s TO %s', [
+            AsIs(self.user), AsIs(self.dbowner)])
+
+        # shared objects, like databases, are reassigned from any database. Do that in the connected database
+        # first, otherwise the parallel statements would concurrently update the same shared catalog rows. The
+        # per-database connections bypass the pooler, like the other session-scoped statements.
+        connect_info = self.direct_connect_info
+        self.drop_owned_in_database(connect_info)
+
+        databases = [database for database in self.get_dependent_databases() if database != self.dbname]
+        if not databases:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.parallelism, len(databases))) as executor:
+            futures = {
+                database: executor.submit(self.drop_owned_in_database, dict(connect_info, dbname=database))
+                for database in databases
+            }
+        failures = ['%s: %s' % (database, future.exception()) for database, future in futures.items()
+                    if future.exception()]
+        if failures:
+            raise ValueError('failed to reassign objects owned by %s, %s' % (self.user, ', '.join(failures)))
+
+    def drop_user(self):
+        if self.deletion_policy == 'Drop':
+            log.info('drop role  %s', self.user)
+            self.execute_statement('DROP ROLE %s', [AsIs(self.user)])
+        else:
+            log.info('disable login of  %s', self.user)
+            self.execute_statement("ALTER ROLE %s NOLOGIN", [AsIs(self.user)])
 
     def drop_database(self):
         if self.deletion_policy == 'Drop':
             log.info('drop database of %s', self.user)
-            with self.connection.cursor() as cursor:
-                cursor.execute('GRANT %s TO %s', [
-                    AsIs(self.user), AsIs(self.dbowner)])
-                cursor.execute('DROP DATABASE %s', [AsIs(self.user)])
+            self.execute_statement('GRANT %s TO %s', [
+                AsIs(self.user), AsIs(self.dbowner)])
+            self.close_idle_sessions()
+            self.execute_statement('DROP DATABASE %s', [AsIs(self.user)],
+                                   connection=self.direct_connection, transaction=False)
         else:
             log.info('not dropping database %s', self.user)
 
+    def close_idle_sessions(self):
+        # the idle pooled connections to the database of the user, of this and of other warm containers, would
+        # keep it from being dropped or moved
+        warmup.pool.evict_database(self.user)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_catalog.pg_terminate_backend(pid) FROM pg_catalog.pg_stat_activity "
+                "WHERE datname = %s AND application_name = %s AND state = 'idle' "
+                "AND pid <> pg_catalog.pg_backend_pid()", [self.user, warmup.application_name])
+            closed = len([row for row in cursor.fetchall() if row[0]])
+        if closed:
+            log.info('closed %d idle connections of other containers to database %s', closed, self.user)
+
     def update_password(self):
         log.info('update password of role %s', self.user)
-        with self.connection.cursor() as cursor:
-            cursor.execute("ALTER ROLE %s LOGIN ENCRYPTED PASSWORD %s", [
-                AsIs(self.user), self.user_password])
+        self.execute_statement("ALTER ROLE %s LOGIN ENCRYPTED PASSWORD %s", [
+            AsIs(self.user), self.encrypted_password(self.user_password)])
 
     def create_role(self):
         log.info('create role %s ', self.user)
-        with self.connection.cursor() as cursor:
-            cursor.execute('CREATE ROLE %s LOGIN ENCRYPTED PASSWORD %s', [
-                AsIs(self.user), self.user_password])
+        self.execute_statement('CREATE ROLE %s LOGIN ENCRYPTED PASSWORD %s', [
+            AsIs(self.user), self.encrypted_password(self.user_password)])
 
     def create_database(self):
         log.info('create database %s', self.user)
-        with self.connection.cursor() as cursor:
-            cursor.execute('GRANT %s TO %s', [
-                AsIs(self.user), AsIs(self.dbowner)])
-            cursor.execute('CREATE DATABASE %s OWNER %s', [
-                AsIs(self.user), AsIs(self.user)])
+        self.execute_statement('GRANT %s TO %s', [
+            AsIs(self.user), AsIs(self.dbowner)])
+        if self.tablespace:
+            self.execute_statement('CREATE DATABASE %s OWNER %s TABLESPACE %s', [
+                AsIs(self.user), AsIs(self.user), AsIs(self.tablespace)],
+                connection=self.direct_connection, transaction=False)
+        else:
+            self.execute_statement('CREATE DATABASE %s OWNER %s', [
+                AsIs(self.user), AsIs(self.user)],
+                connection=self.direct_connection, transaction=False)
+
+    def update_database_settings(self):
+        current = self.get_database_settings()
+        for name, value in sorted(self.database_settings.items()):
+            if current.get(name.lower()) != setting_value(value):
+                log.info('alter database %s set %s to %s', self.user, name, value)
+                self.execute_statement('ALTER DATABASE %s SET %s = %s', [
+                    AsIs(self.user), AsIs(name), value])
+
+        for name in sorted(self.old_database_settings):
+            if name not in self.database_settings and name.lower() in current:
+                log.info('alter database %s reset %s', self.user, name)
+                self.execute_statement('ALTER DATABASE %s RESET %s', [
+                    AsIs(self.user), AsIs(name)])
+
+    def move_tablespace(self):
+        budget = self.time_budget(self.tablespace_move_timeout)
+        if budget <= 0:
+            raise ValueError('no time left to move database %s to tablespace %s' % (self.user, self.tablespace))
+
+        log.info('move database %s to tablespace %s within %d ms', self.user, self.tablespace, budget)
+        self.close_idle_sessions()
+        with self.direct_connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout = %s', [budget])
+            try:
+                cursor.execute('ALTER DATABASE %s SET TABLESPACE %s', [
+                    AsIs(self.user), AsIs(self.tablespace)])
+            except psycopg2.errors.QueryCanceled:
+                raise ValueError('move of database %s to tablespace %s did not complete within %d ms' %
+                                 (self.user, self.tablespace, budget))
+            finally:
+                cursor.execute('RESET statement_timeout')
+
+    def update_database(self):
+        self.update_database_settings()
+        if self.tablespace and self.tablespace != self.get_tablespace():
+            self.move_tablespace()
+        self.seed_database(self.user, self.user)
+
+    def seed_database(self, dbname, role, schema=None):
+        if not self.seeds:
+            return
+
+        connection = warmup.connect(dict(self.direct_connect_info, dbname=dbname))
+        try:
+            seed.load(connection, self.seeds, role, self.s3, schema)
+        finally:
+            connection.close()
 
     def grant_ownership(self):
         log.info('grant ownership on %s to %s', self.user, self.user)
-        with self.connection.cursor() as cursor:
-            cursor.execute('GRANT %s TO %s', [
-                AsIs(self.user), AsIs(self.dbowner)])
-            cursor.execute('ALTER DATABASE %s OWNER TO %s', [
-                AsIs(self.user), AsIs(self.user)])
+        self.execute_statement('GRANT %s TO %s', [
+            AsIs(self.user), AsIs(self.dbowner)])
+        self.execute_statement('ALTER DATABASE %s OWNER TO %s', [
+            AsIs(self.user), AsIs(self.user)])
 
     def drop(self):
         if self.with_database and self.db_exists():
             self.drop_database()
         if self.role_exists():
+            if self.deletion_policy == 'Drop' and self.reassign_owned_to:
+                self.drop_owned()
             self.drop_user()
 
     def create_user(self):
@@ -251,6 +758,7 @@ class PostgreSQLUser(ResourceProvider):
                 self.grant_ownership()
             else:
                 self.create_database()
+            self.update_database()
 
     def create(self):
         try:
@@ -268,6 +776,8 @@ class PostgreSQLUser(ResourceProvider):
             self.connect()
             if self.allow_update:
                 self.update_password()
+                if self.with_database:
+                    self.update_database()
             else:
                 self.fail('Only the password of %s can be updated' % self.user)
         except Exception as e:
@@ -278,6 +788,7 @@ class PostgreSQLUser(ResourceProvider):
     def delete(self):
         if self.physical_resource_id == 'could-not-create':
             self.success('user was never created')
+            return
 
         try:
             self.connect()
@@ -290,6 +801,23 @@ class PostgreSQLUser(ResourceProvider):
     def is_supported_resource_type(self):
         return self.resource_type in  ['Custom::PostgreSQLUser', 'Custom::PostgresDBUser']
 
+    def handle(self, request, context):
+        # a redelivered request is answered with the response of the first delivery
+        key = response_cache.cache.key(request)
+        response = response_cache.cache.get(key)
+        if response is None:
+            response = super(PostgreSQLUser, self).handle(request, context)
+            if response['Status'] == 'SUCCESS' and not self.asynchronous:
+                response_cache.cache.put(key, response)
+            return response
+
+        log.info('request %s was already processed, returning the cached response, %s',
+                 request['RequestId'], response_cache.cache.stats)
+        self.set_request(request, context)
+        self.response = response
+        self.send_response()
+        return self.response
+
 
 provider = PostgreSQLUser()
 
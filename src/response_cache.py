@@ -0,0 +1,71 @@
+import copy
+import logging
+import os
+import time
+from collections import OrderedDict
+
+log = logging.getLogger()
+
+
+class ResponseCache(object):
+    """
+    bounded LRU cache of the responses to CloudFormation requests, so that a redelivered
+    request is answered without doing the work again. Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(request):
+        return (
+            request.get("RequestId"),
+            request.get("StackId"),
+            request.get("LogicalResourceId"),
+            request.get("ResourceType"),
+            request.get("RequestType"),
+        )
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and self.clock() >= entry[0]:
+            del self.entries[key]
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, response):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = (self.clock() + self.ttl, copy.deepcopy(response))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+cache = ResponseCache(int(os.getenv("RESPONSE_CACHE_SIZE", "256")), int(os.getenv("RESPONSE_CACHE_TTL", "3600")))
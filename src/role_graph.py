@@ -0,0 +1,164 @@
+import logging
+from collections import defaultdict
+
+log = logging.getLogger()
+
+
+class RoleGraph(object):
+    """
+    the role membership graph: an edge (role, grantee) means that grantee is a member of role. The
+    `noinherit` memberships do not pass on the privileges of role to grantee, and a new membership
+    of one of the `noinherit_members` does not either.
+
+    The transitive closure and reduction are computed over the roles in topological order,
+    with the set of reachable roles of each member as a bitset in a Python integer, so that
+    graphs with tens of thousands of roles are handled in a fraction of a second.
+    """
+
+    def __init__(self, memberships=(), noinherit=(), noinherit_members=()):
+        self.roles_of = defaultdict(set)
+        for role, grantee in memberships:
+            self.roles_of[grantee].add(role)
+        self.noinherit = set(noinherit)
+        self.noinherit_members = set(noinherit_members)
+
+    @classmethod
+    def load(cls, cursor):
+        # from PostgreSQL 16, every membership has its own inherit option
+        inherit = "a.inherit_option" if cursor.connection.server_version >= 160000 else "m.rolinherit"
+        cursor.execute(
+            "SELECT r.rolname, m.rolname, %s FROM pg_catalog.pg_auth_members a "
+            "JOIN pg_catalog.pg_roles r ON r.oid = a.roleid "
+            "JOIN pg_catalog.pg_roles m ON m.oid = a.member" % inherit
+        )
+        rows = cursor.fetchall()
+        cursor.execute("SELECT rolname FROM pg_catalog.pg_roles WHERE NOT rolinherit")
+        return cls(
+            [(role, grantee) for role, grantee, _ in rows],
+            [(role, grantee) for role, grantee, inherits in rows if not inherits],
+            [r[0] for r in cursor.fetchall()],
+        )
+
+    @property
+    def memberships(self):
+        return {(role, grantee) for grantee, roles in self.roles_of.items() for role in roles}
+
+    def __contains__(self, membership):
+        role, grantee = membership
+        return role in self.roles_of.get(grantee, ())
+
+    def inherits(self, membership):
+        # true if the existing or a new membership passes on the privileges of role to grantee
+        if membership in self:
+            return membership not in self.noinherit
+        return membership[1] not in self.noinherit_members
+
+    def is_member(self, grantee, role):
+        # true if grantee is a direct or indirect member of role
+        seen, todo = {grantee}, [grantee]
+        while todo:
+            for r in self.roles_of.get(todo.pop(), ()):
+                if r == role:
+                    return True
+                if r not in seen:
+                    seen.add(r)
+                    todo.append(r)
+        return False
+
+    def find_cycle(self):
+        # returns the roles of a membership cycle, or None if there is none
+        state = {}
+        for start in list(self.roles_of):
+            if start in state:
+                continue
+            path, stack = [start], [iter(sorted(self.roles_of.get(start, ())))]
+            state[start] = "visiting"
+            while stack:
+                role = next(stack[-1], None)
+                if role is None:
+                    state[path.pop()] = "done"
+                    stack.pop()
+                elif state.get(role) == "visiting":
+                    return path[path.index(role):] + [role]
+                elif role not in state:
+                    state[role] = "visiting"
+                    path.append(role)
+                    stack.append(iter(sorted(self.roles_of.get(role, ()))))
+        return None
+
+    def topological_order(self):
+        # members before the roles they are a member of
+        nodes = set(self.roles_of) | {r for roles in self.roles_of.values() for r in roles}
+        indegree = {n: 0 for n in nodes}
+        for roles in self.roles_of.values():
+            for role in roles:
+                indegree[role] += 1
+        order = [n for n in nodes if indegree[n] == 0]
+        for node in order:
+            for role in self.roles_of.get(node, ()):
+                indegree[role] -= 1
+                if indegree[role] == 0:
+                    order.append(role)
+        if len(order) != len(nodes):
+            raise ValueError("role memberships contain a cycle: %s" % " -> ".join(self.find_cycle()))
+        return order
+
+    def _reachable(self, inheriting=False):
+        # with `inheriting`, only the roles reachable through inheriting memberships
+        order = self.topological_order()
+        index = {node: i for i, node in enumerate(order)}
+        reach = {}
+        for node in reversed(order):
+            bits = 0
+            for role in self.roles_of.get(node, ()):
+                if not inheriting or self.inherits((role, node)):
+                    bits |= reach[role] | (1 << index[role])
+            reach[node] = bits
+        return order, index, reach
+
+    def closure(self):
+        # returns for every member the set of roles it is a direct or indirect member of
+        order, index, reach = self._reachable()
+        result = {}
+        for node in order:
+            bits, roles = reach[node], set()
+            while bits:
+                low = bits & -bits
+                roles.add(order[low.bit_length() - 1])
+                bits ^= low
+            result[node] = roles
+        return result
+
+    def reduction(self):
+        # returns the minimal graph with the same closure. A membership is only implied by a path of
+        # inheriting memberships, as a path through a non-inheriting member does not pass on privileges.
+        order, index, reach = self._reachable(inheriting=True)
+        result = RoleGraph(noinherit=self.noinherit, noinherit_members=self.noinherit_members)
+        for grantee, roles in self.roles_of.items():
+            implied = 0
+            for role in roles:
+                if self.inherits((role, grantee)):
+                    implied |= reach[role]
+            for role in roles:
+                if not implied & (1 << index[role]):
+                    result.roles_of[grantee].add(role)
+        return result
+
+    def plan(self, desired, managed=()):
+        """
+        returns the grants and revokes to get from this graph to the `desired` memberships. Only the
+        minimal set of desired memberships is granted, and only the `managed` memberships, which were
+        previously desired, are revoked when they are no longer desired. A desired membership which is
+        implied by others is not revoked, as it was declared.
+        """
+        desired, managed = set(desired), set(managed)
+        target = RoleGraph((self.memberships - (managed - desired)) | desired)
+        cycle = target.find_cycle()
+        if cycle:
+            raise ValueError("granting would create a membership cycle %s" % " -> ".join(cycle))
+
+        noinherit = {m for m in desired if not self.inherits(m)}
+        minimal = RoleGraph(desired, noinherit).reduction().memberships
+        grants = sorted(m for m in minimal if m not in self)
+        revokes = sorted(m for m in managed - desired if m in self)
+        return grants, revokes
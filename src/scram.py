@@ -0,0 +1,60 @@
+import base64
+import hashlib
+import hmac
+import os
+import stringprep
+import unicodedata
+
+# the SASLprep tables of characters which are prohibited in a password, RFC 4013 section 2.3
+prohibited = [
+    stringprep.in_table_c12,
+    stringprep.in_table_c21,
+    stringprep.in_table_c22,
+    stringprep.in_table_c3,
+    stringprep.in_table_c4,
+    stringprep.in_table_c5,
+    stringprep.in_table_c6,
+    stringprep.in_table_c7,
+    stringprep.in_table_c8,
+    stringprep.in_table_c9,
+]
+
+
+def saslprep(password):
+    """
+    prepares the password like PostgreSQL does: non-ASCII spaces are mapped to a space, characters
+    mapped to nothing are removed and the result is NFKC normalized. Like PostgreSQL, the password is
+    used as is when it contains prohibited or unassigned characters, or violates the bidirectional
+    rules of RFC 3454 section 6.
+    """
+    if password.isascii():
+        return password
+
+    mapped = "".join(" " if stringprep.in_table_c12(c) else c for c in password if not stringprep.in_table_b1(c))
+    normalized = unicodedata.normalize("NFKC", mapped)
+    if any(stringprep.in_table_a1(c) or any(table(c) for table in prohibited) for c in normalized):
+        return password
+
+    # a string with right-to-left characters has no left-to-right characters, and starts and ends right-to-left
+    if any(stringprep.in_table_d1(c) for c in normalized):
+        if any(stringprep.in_table_d2(c) for c in normalized):
+            return password
+        if not (stringprep.in_table_d1(normalized[0]) and stringprep.in_table_d1(normalized[-1])):
+            return password
+    return normalized
+
+
+def b64(value):
+    return base64.b64encode(value).decode("ascii")
+
+
+def verifier(password, iterations=4096, salt=None):
+    """
+    returns the SCRAM-SHA-256 verifier of the password, in the format in which PostgreSQL stores it.
+    """
+    salt = salt if salt is not None else os.urandom(16)
+    salted = hashlib.pbkdf2_hmac("sha256", saslprep(password).encode("utf-8"), salt, iterations)
+    client_key = hmac.new(salted, b"Client Key", hashlib.sha256).digest()
+    stored_key = hashlib.sha256(client_key).digest()
+    server_key = hmac.new(salted, b"Server Key", hashlib.sha256).digest()
+    return "SCRAM-SHA-256$%d:%s$%s:%s" % (iterations, b64(salt), b64(stored_key), b64(server_key))
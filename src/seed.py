@@ -0,0 +1,191 @@
+import codecs
+import hashlib
+import logging
+import re
+from urllib.parse import urlparse
+
+from psycopg2.extensions import AsIs
+
+log = logging.getLogger()
+
+# the number of bytes read from an artifact at a time
+chunk_size = 64 * 1024
+
+seed_schema = {
+    "type": "array",
+    "description": "the SQL or CSV artifacts to load into the database",
+    "items": {
+        "type": "object",
+        "required": ["Location"],
+        "properties": {
+            "Location": {
+                "type": "string",
+                "pattern": "^(s3://[^/]+/.+|[^:]+)$",
+                "description": "the s3:// url or the local path of the artifact",
+            },
+            "Format": {
+                "type": "string",
+                "enum": ["sql", "csv"],
+                "description": "of the artifact, defaults to the extension of the location",
+            },
+            "Table": {
+                "type": "string",
+                "pattern": "^[_A-Za-z][A-Za-z0-9_$]*(\\.[_A-Za-z][A-Za-z0-9_$]*)?$",
+                "description": "to copy the CSV artifact into",
+            },
+            "Header": {
+                "type": "boolean",
+                "default": True,
+                "description": "the first line of the CSV artifact contains the column names",
+            },
+        },
+    },
+}
+
+# the statement on the last line of which the data of a COPY FROM stdin follows
+copy_from_stdin = re.compile(r"^\s*COPY\s.*\sFROM\s+stdin\b.*;\s*$", re.IGNORECASE | re.DOTALL)
+dollar_quote = re.compile(r"\$[A-Za-z_0-9]*\$")
+
+
+class Artifact(object):
+    """
+    a seed artifact on S3 or on the local file system. The checksum is the ETag of the S3 object,
+    or the SHA-256 of the local file.
+    """
+
+    def __init__(self, seed, s3):
+        self.location = seed["Location"]
+        self.format = seed.get("Format", "csv" if self.location.lower().endswith(".csv") else "sql")
+        self.table = seed.get("Table")
+        self.header = seed.get("Header", True)
+        self.s3 = s3
+        if self.format == "csv" and not self.table:
+            raise ValueError("the Table to copy %s into is required" % self.location)
+
+    @property
+    def is_s3(self):
+        return self.location.startswith("s3://")
+
+    @property
+    def bucket_and_key(self):
+        url = urlparse(self.location)
+        return url.netloc, url.path.lstrip("/")
+
+    @property
+    def checksum(self):
+        if self.is_s3:
+            bucket, key = self.bucket_and_key
+            return "etag:%s" % self.s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+
+        digest = hashlib.sha256()
+        with open(self.location, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return "sha256:%s" % digest.hexdigest()
+
+    def open(self):
+        # returns a binary stream of the content
+        if self.is_s3:
+            bucket, key = self.bucket_and_key
+            return self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+        return open(self.location, "rb")
+
+
+class CopyData(object):
+    """
+    the data lines of a COPY FROM stdin in a SQL script, up to the terminating line.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.done = False
+
+    def read(self, size=chunk_size):
+        chunk, length = [], 0
+        while not self.done and length < size:
+            line = next(self.lines, "\\.")
+            if line.rstrip("\r\n") == "\\.":
+                self.done = True
+            else:
+                chunk.append(line)
+                length += len(line)
+        return "".join(chunk)
+
+
+def statements(lines):
+    """
+    splits a SQL script into statements, which end with a semicolon at the end of a line. A statement
+    is followed by its data when it is a COPY FROM stdin, which is read from `lines` by the caller.
+    Blank and comment lines before a statement are skipped, like the headers pg_dump writes.
+    """
+    statement, in_dollar_quote = [], False
+    for line in lines:
+        if not statement and (not line.strip() or line.lstrip().startswith("--")):
+            continue
+        statement.append(line)
+        if len(dollar_quote.findall(line)) % 2:
+            in_dollar_quote = not in_dollar_quote
+        if not in_dollar_quote and line.rstrip().endswith(";"):
+            yield "".join(statement)
+            statement = []
+    if "".join(statement).strip():
+        yield "".join(statement)
+
+
+def load_sql(cursor, stream):
+    lines = iter(codecs.getreader("utf-8")(stream))
+    for statement in statements(lines):
+        if copy_from_stdin.match(statement):
+            cursor.copy_expert(statement, CopyData(lines), size=chunk_size)
+        else:
+            # the statement is sent as is, without parameters
+            cursor.execute(statement)
+
+
+def load_csv(cursor, stream, table, header):
+    cursor.copy_expert(
+        cursor.mogrify("COPY %s FROM STDIN WITH (FORMAT csv, HEADER %s)", [AsIs(table), header]).decode("utf-8"),
+        stream,
+        size=chunk_size,
+    )
+
+
+def load(connection, seeds, role, s3, schema=None):
+    """
+    loads the `seeds` into the database of `connection` as `role`, every artifact in a transaction
+    of its own. The checksums of the loaded artifacts are recorded in the table cfn_seed_log, and
+    an artifact with a recorded checksum is skipped.
+    """
+    for seed in seeds:
+        artifact = Artifact(seed, s3)
+        checksum = artifact.checksum
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL ROLE %s", [AsIs(role)])
+                if schema:
+                    cursor.execute("SET LOCAL search_path = %s", [AsIs(schema)])
+                cursor.execute(
+                    "CREATE TABLE IF NOT EXISTS cfn_seed_log ("
+                    "location text, checksum text, loaded_at timestamptz DEFAULT now(), "
+                    "PRIMARY KEY (location, checksum))"
+                )
+                cursor.execute(
+                    "SELECT loaded_at FROM cfn_seed_log WHERE location = %s AND checksum = %s",
+                    [artifact.location, checksum],
+                )
+                if cursor.fetchone():
+                    log.info("skipping %s, %s is already loaded", artifact.location, checksum)
+                    continue
+
+                log.info("loading %s into database %s", artifact.location, connection.info.dbname)
+                stream = artifact.open()
+                try:
+                    if artifact.format == "csv":
+                        load_csv(cursor, stream, artifact.table, artifact.header)
+                    else:
+                        load_sql(cursor, stream)
+                finally:
+                    stream.close()
+                cursor.execute(
+                    "INSERT INTO cfn_seed_log (location, checksum) VALUES (%s, %s)", [artifact.location, checksum]
+                )
@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import socket
+import time
+
+import psycopg2
+
+log = logging.getLogger()
+
+
+class DNSCache(object):
+    """
+    caches the address of database hosts for `ttl` seconds. After a failover, the
+    cached address is invalidated by the caller and the host is resolved again.
+    """
+
+    def __init__(self, ttl=5, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+
+    def resolve(self, host, port):
+        entry = self.entries.get(host)
+        if entry is not None and self.clock() < entry[1]:
+            return entry[0]
+
+        address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+        self.entries[host] = (address, self.clock() + self.ttl)
+        return address
+
+    def invalidate(self, host):
+        return self.entries.pop(host, None) is not None
+
+
+class SecretCache(object):
+    """
+    caches the database owner passwords obtained from the Parameter Store.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, name, loader):
+        if name not in self.entries:
+            self.entries[name] = loader(name)
+        return self.entries[name]
+
+    def invalidate(self, name):
+        return self.entries.pop(name, None) is not None
+
+
+class ConnectionPool(object):
+    """
+    keeps one idle connection per host, port, database and user open between invocations. A
+    connection to a server which has become a standby is not handed out.
+    """
+
+    def __init__(self):
+        self.connections = {}
+
+    def take(self, key):
+        connection = self.connections.pop(key, None)
+        if connection is None or connection.closed:
+            return None
+
+        try:
+            connection.set_session(autocommit=True)
+            if is_read_write(connection):
+                return connection
+            log.info("discarding connection to %s, which is read-only", key[0])
+            connection.close()
+            return None
+        except psycopg2.Error as e:
+            log.info("discarding stale connection to %s, %s", key[0], e)
+            connection.close()
+            return None
+
+    def give(self, key, connection):
+        previous = self.connections.pop(key, None)
+        if previous is not None and previous is not connection:
+            previous.close()
+        self.connections[key] = connection
+
+    def evict_database(self, dbname):
+        # closes the idle connections to the database, which would keep it from being dropped or moved
+        for key in [k for k in self.connections if k[2] == dbname]:
+            log.info("closing idle connection to database %s on %s", dbname, key[0])
+            self.connections.pop(key).close()
+
+
+# must not exceed the TTL of the DNS records of the database endpoints, which is 5 seconds for Aurora
+dns = DNSCache(int(os.getenv("DNS_CACHE_TTL", "5")))
+secrets = SecretCache()
+pool = ConnectionPool()
+
+# identifies the sessions of the provider, also those of other warm containers
+application_name = "cfn-postgresql-user-provider"
+
+# seconds to wait for each host of a database with multiple hosts
+connect_timeout = int(os.getenv("CONNECT_TIMEOUT", "2"))
+
+# the last known primary of each cluster, by the list of hosts of the cluster
+primaries = {}
+
+
+def hosts_of(host):
+    # the `Host` of a database is a host name, a comma separated list of host names or a list of host names
+    if isinstance(host, str):
+        host = host.split(",")
+    return [h.strip() for h in host if h.strip()]
+
+
+def same_hosts(host, other):
+    # true if the hosts are of the same cluster: hosts may be reordered, added or removed, as long as one remains
+    return bool(set(hosts_of(host)) & set(hosts_of(other)))
+
+
+def is_read_write(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_catalog.pg_is_in_recovery() OR current_setting('transaction_read_only') = 'on'")
+        return not cursor.fetchone()[0]
+
+
+def connect(connect_info):
+    # connects to the address of the host in the DNS cache, as the provider
+    connect_info = dict(connect_info, application_name=application_name)
+    if not connect_info["host"].startswith("/"):
+        connect_info = dict(connect_info, hostaddr=dns.resolve(connect_info["host"], connect_info["port"]))
+    return psycopg2.connect(**connect_info)
+
+
+def connect_read_write(connect_info, connect_timeout):
+    """
+    connects to a single host within `connect_timeout` seconds and checks that it accepts writes. After
+    a failover, the cached address may be that of the demoted writer: the host is then resolved again
+    and reconnected.
+    """
+    for _ in range(2):
+        connection = connect(dict(connect_info, connect_timeout=connect_timeout))
+        connection.autocommit = True
+        if is_read_write(connection):
+            return connection
+        connection.close()
+        if not dns.invalidate(connect_info["host"]):
+            break
+        log.info("%s is read-only, resolving the address again", connect_info["host"])
+    raise psycopg2.OperationalError("%s is read-only" % connect_info["host"])
+
+
+def connect_primary(hosts, connect_info_of, connect_timeout):
+    """
+    connects to the read-write server among `hosts`, like libpq does with target_session_attrs=read-write.
+    The last known primary of the cluster is tried first, and every host gets at most `connect_timeout`
+    seconds to accept the connection. `connect_info_of` returns the connection parameters of a host.
+    """
+    cluster = tuple(hosts)
+    primary = primaries.get(cluster)
+    errors = []
+    for host in sorted(hosts, key=lambda h: h != primary):
+        try:
+            connection = connect(dict(connect_info_of(host), connect_timeout=connect_timeout))
+        except (psycopg2.OperationalError, OSError) as e:
+            errors.append("%s: %s" % (host, str(e).strip()))
+            continue
+
+        try:
+            connection.autocommit = True
+            if is_read_write(connection):
+                if host != primary:
+                    log.info("%s is the primary of %s", host, ",".join(hosts))
+                primaries[cluster] = host
+                return connection
+            errors.append("%s: read-only" % host)
+        except psycopg2.Error as e:
+            errors.append("%s: %s" % (host, str(e).strip()))
+        connection.close()
+
+    primaries.pop(cluster, None)
+    raise psycopg2.OperationalError("no read-write server found, %s" % "; ".join(errors))
+
+
+def prefetch(ssm, rds):
+    """
+    warms up the caches during the initialization of the lambda, for the databases
+    listed in the environment variable WARMUP_DATABASES. This is a JSON array of objects
+    in the same format as the `Database` property of the resources.
+    """
+    try:
+        databases = json.loads(os.getenv("WARMUP_DATABASES", "[]"))
+    except ValueError as e:
+        log.warning("failed to parse WARMUP_DATABASES, %s", e)
+        return
+
+    for database in databases:
+        started = time.monotonic()
+        hosts, port, user = hosts_of(database["Host"]), database.get("Port", 5432), database["User"]
+        host = ",".join(hosts)
+        try:
+            if "PasswordParameterName" in database:
+                password = secrets.get(
+                    database["PasswordParameterName"],
+                    lambda name: ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"]["Value"],
+                )
+            else:
+                password = database.get("Password")
+
+            def connect_info_of(h):
+                result = {"host": h, "port": port, "dbname": database["DBName"], "user": user, "password": password}
+                if database.get("IamAuth"):
+                    result["password"] = rds.generate_db_auth_token(DBHostname=h, Port=port, DBUsername=user)
+                    result["sslmode"] = "require"
+                return result
+
+            if len(hosts) == 1:
+                connection = connect_read_write(connect_info_of(host), connect_timeout)
+            else:
+                connection = connect_primary(hosts, connect_info_of, connect_timeout)
+            connection.set_session(autocommit=True)
+            pool.give((host, port, database["DBName"], user), connection)
+            log.info("warmed up connection to %s in %.0f ms", host, (time.monotonic() - started) * 1000)
+        except Exception as e:
+            log.warning("failed to warm up connection to %s, %s", host, e)
@@ -0,0 +1,15 @@
+import pytest
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    # a monotonic clock which only advances when the test sets `now`
+    return Clock()
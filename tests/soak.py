@@ -0,0 +1,305 @@
+"""
+Concurrency soak harness for the providers.
+
+Drives a number of simulated CloudFormation stacks against a local PostgreSQL server.
+Every stack creates, updates and deletes users, a schema and a role grant through the
+`handler` functions of the providers. Each stack runs in its own process, just like
+concurrent Lambda containers. The Parameter Store and the delivery of the response
+to CloudFormation are faked.
+
+    PYTHONPATH=src python tests/soak.py --stacks 50 --concurrency 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import psycopg2
+from botocore.exceptions import ClientError
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+
+class FakeSSM(object):
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+    def get_parameter(self, Name, WithDecryption=False):
+        if Name not in self.parameters:
+            raise ClientError(
+                {"Error": {"Code": "ParameterNotFound", "Message": Name}}, "GetParameter"
+            )
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+
+class FakeResponse(object):
+    status_code = 200
+    text = ""
+
+
+def fake_container(owner_password):
+    """
+    initializes a worker process as a Lambda container with a fake Parameter Store and
+    CloudFormation response endpoint.
+    """
+    import requests
+    import postgresql_user_provider
+    import postgresql_schema_provider
+    import postgresql_role_grant_provider
+
+    os.environ["LOG_LEVEL"] = "WARNING"
+    requests.put = lambda *args, **kwargs: FakeResponse()
+    ssm = FakeSSM({"/soak/owner": owner_password})
+    for module in [postgresql_user_provider, postgresql_schema_provider, postgresql_role_grant_provider]:
+        module.provider.ssm = ssm
+
+
+class Stack(object):
+    def __init__(self, options, index):
+        self.options = options
+        self.name = "soak_%s_%d" % (options.run_id, index)
+        self.results = []
+        import postgresql_user_provider
+
+        self.ssm = postgresql_user_provider.provider.ssm
+
+    @property
+    def database(self):
+        return {
+            "Host": self.options.host,
+            "Port": self.options.port,
+            "DBName": self.options.dbname,
+            "User": self.options.user,
+            "PasswordParameterName": "/soak/owner",
+        }
+
+    def request(self, request_type, resource_type, logical_id, properties, physical_id=None, old_properties=None):
+        result = {
+            "RequestType": request_type,
+            "ResponseURL": "https://httpbin.org/put",
+            "StackId": "arn:aws:cloudformation:eu-central-1:EXAMPLE/%s/guid" % self.name,
+            "RequestId": "request-%s" % uuid.uuid4(),
+            "ResourceType": resource_type,
+            "LogicalResourceId": logical_id,
+            "ResourceProperties": dict(properties, Database=self.database),
+        }
+        if physical_id is not None:
+            result["PhysicalResourceId"] = physical_id
+        if old_properties is not None:
+            result["OldResourceProperties"] = old_properties
+        return result
+
+    def invoke(self, operation, request):
+        from postgresql import handler
+
+        retries = 0
+        started = time.perf_counter()
+        while True:
+            response = handler(request, {})
+            if response["Status"] == "SUCCESS" or retries >= self.options.retries:
+                break
+            retries += 1
+            time.sleep(min(0.1 * 2 ** retries, 2.0))
+
+        self.results.append(
+            {
+                "operation": operation,
+                "latency": time.perf_counter() - started,
+                "status": response["Status"],
+                "reason": response["Reason"],
+                "retries": retries,
+            }
+        )
+        return response
+
+    def user(self, request_type, name, with_database, physical_id=None, **properties):
+        self.ssm.parameters["/soak/%s" % name] = str(uuid.uuid4())
+        properties.update({"User": name, "PasswordParameterName": "/soak/%s" % name, "WithDatabase": with_database})
+        request = self.request(request_type, "Custom::PostgreSQLUser", name, properties, physical_id)
+        return self.invoke("user:%s" % request_type.lower(), request).get("PhysicalResourceId")
+
+    def schema(self, request_type, schema, owner, physical_id=None, old_properties=None, **properties):
+        properties.update({"Schema": schema, "Owner": owner})
+        request = self.request(
+            request_type, "Custom::PostgreSQLSchema", "Schema", properties, physical_id, old_properties
+        )
+        return self.invoke("schema:%s" % request_type.lower(), request).get("PhysicalResourceId")
+
+    def grant(self, request_type, role, grantee, physical_id=None):
+        properties = {"Role": role, "Grantee": grantee}
+        request = self.request(request_type, "Custom::PostgreSQLRoleGrant", "Grant", properties, physical_id)
+        return self.invoke("grant:%s" % request_type.lower(), request).get("PhysicalResourceId")
+
+    def run(self):
+        app, reader = self.name + "_app", self.name + "_reader"
+        schema, renamed = self.name + "_s1", self.name + "_s2"
+
+        app_id = self.user("Create", app, True)
+        reader_id = self.user("Create", reader, False)
+        schema_id = self.schema("Create", schema, app)
+        grant_id = self.grant("Create", app, reader)
+
+        self.user("Update", app, True, app_id)
+        schema_id = self.schema(
+            "Update", renamed, reader, schema_id, old_properties={"Schema": schema, "Owner": app}
+        )
+
+        self.grant("Delete", app, reader, grant_id)
+        self.schema("Delete", renamed, reader, schema_id, DeletionPolicy="Drop")
+        self.user("Delete", reader, False, reader_id, DeletionPolicy="Drop")
+        self.user("Delete", app, True, app_id, DeletionPolicy="Drop")
+        return self.results
+
+
+def run_stack(options, index):
+    return Stack(options, index).run()
+
+
+class LockSampler(threading.Thread):
+    """
+    samples the number of ungranted locks and the number of sessions waiting on a lock.
+    """
+
+    def __init__(self, options):
+        super(LockSampler, self).__init__(daemon=True)
+        self.options = options
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        connection = psycopg2.connect(
+            host=self.options.host,
+            port=self.options.port,
+            dbname=self.options.dbname,
+            user=self.options.user,
+            password=self.options.password,
+        )
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                while not self.stopped.is_set():
+                    cursor.execute(
+                        "SELECT (SELECT count(*) FROM pg_catalog.pg_locks WHERE NOT granted), "
+                        "(SELECT count(*) FROM pg_catalog.pg_stat_activity WHERE wait_event_type = 'Lock')"
+                    )
+                    self.samples.append(cursor.fetchone())
+                    self.stopped.wait(self.options.sample_interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, int(round(p / 100.0 * len(ordered))) - 1)]
+
+
+def summarize(results, elapsed, samples):
+    def latencies(rs):
+        values = [r["latency"] for r in rs]
+        return {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+
+    by_operation = defaultdict(list)
+    for r in results:
+        by_operation[r["operation"]].append(r)
+
+    waiting_locks = [s[0] for s in samples] or [0]
+    waiting_sessions = [s[1] for s in samples] or [0]
+    return {
+        "operations": len(results),
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed if elapsed else 0.0,
+        "errors": sum(1 for r in results if r["status"] != "SUCCESS"),
+        "retries": sum(r["retries"] for r in results),
+        "latency": latencies(results) if results else {},
+        "latency_by_operation": {op: latencies(rs) for op, rs in sorted(by_operation.items())},
+        "lock_waits": {
+            "samples": len(samples),
+            "max_ungranted_locks": max(waiting_locks),
+            "mean_ungranted_locks": statistics.mean(waiting_locks),
+            "max_waiting_sessions": max(waiting_sessions),
+            "mean_waiting_sessions": statistics.mean(waiting_sessions),
+        },
+        "failures": sorted(set(r["reason"] for r in results if r["status"] != "SUCCESS")),
+    }
+
+
+def report(summary):
+    print("operations  %d in %.1fs, %.1f ops/s" % (summary["operations"], summary["elapsed"], summary["throughput"]))
+    print("errors      %d, retries %d" % (summary["errors"], summary["retries"]))
+    print("%-16s %6s %8s %8s %8s" % ("operation", "count", "p50", "p95", "p99"))
+    rows = list(summary["latency_by_operation"].items()) + [("all", summary["latency"])]
+    for operation, latency in rows:
+        if latency:
+            print(
+                "%-16s %6d %7.0fms %7.0fms %7.0fms"
+                % (operation, latency["count"], latency["p50"] * 1000, latency["p95"] * 1000, latency["p99"] * 1000)
+            )
+    locks = summary["lock_waits"]
+    print(
+        "lock waits  %d samples, ungranted locks max %d mean %.1f, waiting sessions max %d mean %.1f"
+        % (
+            locks["samples"],
+            locks["max_ungranted_locks"],
+            locks["mean_ungranted_locks"],
+            locks["max_waiting_sessions"],
+            locks["mean_waiting_sessions"],
+        )
+    )
+    for reason in summary["failures"]:
+        print("failure     %s" % reason)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="concurrency soak test of the PostgreSQL providers")
+    parser.add_argument("--stacks", type=int, default=20, help="number of simulated stacks")
+    parser.add_argument("--concurrency", type=int, default=5, help="number of stacks running at the same time")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--dbname", default="postgres")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--retries", type=int, default=0, help="number of retries of a failed request")
+    parser.add_argument("--sample-interval", type=float, default=0.05, help="seconds between lock samples")
+    parser.add_argument("--json", action="store_true", help="report in JSON")
+    options = parser.parse_args(argv)
+    options.run_id = uuid.uuid4().hex[:8]
+
+    sampler = LockSampler(options)
+    sampler.start()
+    results = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=options.concurrency, initializer=fake_container, initargs=(options.password,)
+    ) as executor:
+        futures = [executor.submit(run_stack, options, i) for i in range(options.stacks)]
+        for future in as_completed(futures):
+            results.extend(future.result())
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+
+    summary = summarize(results, elapsed, sampler.samples)
+    if options.json:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        report(summary)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import json
+import uuid
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from postgresql import handler
+from test_postgresql_user_provider import Event
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30, clock=clock)
+    for _ in range(2):
+        breaker.before_connect("db:5432")
+        breaker.on_failure("db:5432", "connection refused")
+    assert breaker.state("db:5432") == circuit_breaker.CLOSED
+
+    breaker.on_failure("db:5432", "connection refused")
+    assert breaker.state("db:5432") == circuit_breaker.OPEN
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.before_connect("db:5432")
+    assert "db:5432 is unreachable" in str(e.value)
+    assert "connection refused" in str(e.value)
+
+    # other endpoints are not affected
+    breaker.before_connect("other:5432")
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=30, clock=clock)
+    breaker.on_failure("db:5432", "timeout")
+    breaker.on_success("db:5432")
+    breaker.on_failure("db:5432", "timeout")
+    assert breaker.state("db:5432") == circuit_breaker.CLOSED
+
+
+def test_half_open_after_cooldown(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=30, clock=clock)
+    breaker.on_failure("db:5432", "timeout")
+    assert breaker.state("db:5432") == circuit_breaker.OPEN
+
+    clock.now = 30
+    breaker.before_connect("db:5432")
+    assert breaker.state("db:5432") == circuit_breaker.HALF_OPEN
+
+    # a failed probe opens the circuit for another cool down
+    breaker.on_failure("db:5432", "timeout")
+    assert breaker.state("db:5432") == circuit_breaker.OPEN
+    clock.now = 59
+    with pytest.raises(CircuitOpenError):
+        breaker.before_connect("db:5432")
+
+    clock.now = 60
+    breaker.before_connect("db:5432")
+    breaker.on_success("db:5432")
+    assert breaker.state("db:5432") == circuit_breaker.CLOSED
+
+
+def test_metrics(capsys, clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=30, clock=clock)
+    breaker.on_failure("db:5432", "timeout")
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r.get("ConnectFailures", r.get("CircuitState")) for r in records] == [1, 2]
+    assert all(r["Endpoint"] == "db:5432" for r in records)
+    assert records[1]["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "CircuitState", "Unit": "None"}]
+
+
+def test_unreachable_database_fails_fast(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "breaker", CircuitBreaker(threshold=2, cooldown=30))
+    name = "u%s" % str(uuid.uuid4()).replace("-", "")
+    for i in range(3):
+        event = Event("Create", name)
+        event["ResourceProperties"]["Database"]["Host"] = "127.0.0.2"
+        response = handler(event, {})
+        assert response["Status"] == "FAILED"
+        assert ("is unreachable" in response["Reason"]) == (i == 2), response["Reason"]
+
+
+def test_connect_timeout(monkeypatch):
+    import warmup
+
+    monkeypatch.setattr(circuit_breaker, "breaker", CircuitBreaker(threshold=2, cooldown=30))
+    monkeypatch.setattr(warmup, "pool", warmup.ConnectionPool())
+    timeouts = []
+
+    def unreachable(connect_info):
+        # like a firewalled endpoint, which does not answer before the timeout
+        timeouts.append(connect_info.get("connect_timeout"))
+        raise OSError("timeout expired")
+
+    class Context(object):
+        def __init__(self, remaining):
+            self.remaining = remaining
+
+        def get_remaining_time_in_millis(self):
+            return self.remaining
+
+    monkeypatch.setattr(warmup, "connect", unreachable)
+    name = "u%s" % str(uuid.uuid4()).replace("-", "")
+    event = Event("Create", name)
+    response = handler(event, Context(30000))
+    assert response["Status"] == "FAILED"
+    assert timeouts and all(t == warmup.connect_timeout for t in timeouts)
+
+    # the timeout is bounded by the remaining execution time, so that the failure is counted
+    del timeouts[:]
+    event = Event("Create", name)
+    response = handler(event, Context(6500))
+    assert response["Status"] == "FAILED"
+    assert timeouts and all(t == 1 for t in timeouts)
+    assert circuit_breaker.breaker.state("localhost:5432") == circuit_breaker.OPEN
@@ -0,0 +1,108 @@
+import uuid
+
+import psycopg2
+import pytest
+from psycopg2.extensions import AsIs
+
+import placement
+import warmup
+from placement import Load, LoadSamples
+from postgresql import handler
+from test_postgresql_user_provider import Event
+
+
+def candidate(host, dbname="postgres"):
+    return {"Host": host, "Port": 5432, "DBName": dbname, "User": "postgres", "Password": "password"}
+
+
+def test_least_loaded_is_chosen():
+    candidates = [candidate("a"), candidate("b"), candidate("c")]
+    loads = {
+        ("a", 5432, "postgres"): Load(databases=10, size=100, connections=5),
+        ("b", 5432, "postgres"): Load(databases=2, size=50, connections=1),
+        ("c", 5432, "postgres"): Load(databases=4, size=300, connections=0),
+    }
+    assert placement.choose(candidates, loads, "tenant")["Host"] == "b"
+
+    # candidates which are not sampled are never chosen
+    del loads[("b", 5432, "postgres")]
+    assert placement.choose(candidates, loads, "tenant")["Host"] == "c"
+
+
+def test_stable_tie_break():
+    candidates = [candidate("a"), candidate("b"), candidate("c")]
+    loads = {placement.target_of(c): Load(1, 1, 1) for c in candidates}
+    chosen = {}
+    for i in range(30):
+        tenant = "tenant_%d" % i
+        chosen[tenant] = placement.choose(candidates, loads, tenant)["Host"]
+        assert placement.choose(list(reversed(candidates)), loads, tenant)["Host"] == chosen[tenant]
+    assert set(chosen.values()) == {"a", "b", "c"}
+
+
+def test_load_samples_are_cached(clock):
+    samples = LoadSamples(ttl=30, clock=clock)
+    sampled = []
+
+    def sampler():
+        sampled.append(clock.now)
+        return Load(1, 1, 1)
+
+    assert samples.get("a", sampler) == Load(1, 1, 1)
+    samples.add_database("a")
+    assert samples.get("a", sampler) == Load(2, 1, 1)
+    clock.now = 30
+    assert samples.get("a", sampler) == Load(1, 1, 1)
+    assert sampled == [0.0, 30]
+
+
+def test_place_user(monkeypatch, other_database):
+    monkeypatch.setattr(placement, "samples", LoadSamples(ttl=30))
+    monkeypatch.setattr(warmup, "pool", warmup.ConnectionPool())
+    name = "u%s" % str(uuid.uuid4()).replace("-", "")
+    candidates = [candidate("127.0.0.2"), candidate("localhost"), candidate("localhost", other_database)]
+    event = Event("Create", name)
+    del event["ResourceProperties"]["Database"]
+    event["ResourceProperties"]["Candidates"] = candidates
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    physical_resource_id = response["PhysicalResourceId"]
+    assert physical_resource_id in [
+        "postgresql:localhost:5432:postgres::%s" % name,
+        "postgresql:localhost:5432:%s::%s" % (other_database, name),
+    ]
+
+    # updates and deletes go to the database the user was placed on
+    event = Event("Update", name, physical_resource_id)
+    del event["ResourceProperties"]["Database"]
+    event["ResourceProperties"]["Candidates"] = list(reversed(candidates))
+    event["ResourceProperties"]["Password"] = "new-password"
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert response["PhysicalResourceId"] == physical_resource_id
+
+    event = Event("Delete", name, physical_resource_id)
+    del event["ResourceProperties"]["Database"]
+    event["ResourceProperties"]["Candidates"] = candidates[:1]
+    response = handler(event, {})
+    assert response["Status"] == "FAILED"
+    assert "no longer one of the Candidates" in response["Reason"]
+
+    event["ResourceProperties"]["Candidates"] = candidates
+    event["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+
+
+@pytest.fixture
+def other_database():
+    name = "p%s" % str(uuid.uuid4()).replace("-", "")
+    connection = psycopg2.connect(host="localhost", port=5432, dbname="postgres", user="postgres", password="password")
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE DATABASE %s", [AsIs(name)])
+    yield name
+    warmup.pool.evict_database(name)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP DATABASE %s", [AsIs(name)])
+    connection.close()
@@ -0,0 +1,79 @@
+import logging
+import uuid
+
+import psycopg2
+
+from postgresql import handler
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_create_extensions():
+    request = Request("Create", [{"Name": "pg_trgm"}, {"Name": "fuzzystrmatch", "Schema": "public"}])
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert response["PhysicalResourceId"] == "extension:postgres:Whatever"
+    assert request.installed_extensions().keys() >= {"pg_trgm", "fuzzystrmatch"}
+
+    request = Request("Update", [{"Name": "pg_trgm"}], response["PhysicalResourceId"])
+    request["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    request["OldResourceProperties"] = {"Extensions": [{"Name": "pg_trgm"}, {"Name": "fuzzystrmatch"}]}
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert "fuzzystrmatch" not in request.installed_extensions()
+
+    request = Request("Delete", [{"Name": "pg_trgm"}], response["PhysicalResourceId"])
+    request["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert "pg_trgm" not in request.installed_extensions()
+
+
+def test_create_unknown_extension_is_rolled_back():
+    request = Request("Create", [{"Name": "pg_trgm"}, {"Name": "does_not_exist"}])
+    response = handler(request, {})
+    assert response["Status"] == "FAILED", response["Reason"]
+    assert "pg_trgm" not in request.installed_extensions()
+
+
+class Request(dict):
+    def __init__(self, request_type, extensions, physical_resource_id=None):
+        self.update(
+            {
+                "RequestType": request_type,
+                "ResponseURL": "https://httpbin.org/put",
+                "StackId": "arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid",
+                "RequestId": "request-%s" % str(uuid.uuid4()),
+                "ResourceType": "Custom::PostgreSQLExtension",
+                "LogicalResourceId": "Whatever",
+                "ResourceProperties": {
+                    "Extensions": extensions,
+                    "Database": {
+                        "User": "postgres",
+                        "Password": "password",
+                        "Host": "localhost",
+                        "Port": 5432,
+                        "DBName": "postgres",
+                    },
+                },
+            }
+        )
+        if physical_resource_id is not None:
+            self["PhysicalResourceId"] = physical_resource_id
+
+    def db_connection(self):
+        p = self["ResourceProperties"]
+        args = {
+            "host": p["Database"]["Host"],
+            "port": p["Database"]["Port"],
+            "dbname": p["Database"]["DBName"],
+            "user": p["Database"]["User"],
+            "password": p["Database"]["Password"],
+        }
+        return psycopg2.connect(**args)
+
+    def installed_extensions(self):
+        with self.db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT extname, extversion FROM pg_catalog.pg_extension")
+                return dict(cursor.fetchall())
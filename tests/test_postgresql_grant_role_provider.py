@@ -26,6 +26,128 @@ def test_grant_role(pg_users):
     response = handler(request, {})
     assert response["Status"] == "SUCCESS", response["Reason"]
 
+def test_grant_memberships(pg_users):
+    readonly, readwrite = pg_users
+    app = readwrite.replace("user2_", "app_")
+    r = Request("Create", readonly, readwrite)
+    with r.db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE ROLE %s", [AsIs(app)])
+        connection.commit()
+    try:
+        memberships = [
+            {"Role": readwrite, "Grantee": app},
+            {"Role": readonly, "Grantee": readwrite},
+            {"Role": readonly, "Grantee": app},
+        ]
+        request = Request("Create", None, None, memberships=memberships)
+        response = handler(request, {})
+        assert response["Status"] == "SUCCESS", response["Reason"]
+        assert response["PhysicalResourceId"] == "grants:postgres:Whatever"
+        assert get_memberships(r, [readonly, readwrite, app]) == {(readwrite, app), (readonly, readwrite)}
+
+        # a membership cycle is rejected before it is granted
+        request = Request(
+            "Update", None, None, response["PhysicalResourceId"], memberships + [{"Role": app, "Grantee": readonly}]
+        )
+        request["OldResourceProperties"] = {"Memberships": memberships}
+        response = handler(request, {})
+        assert response["Status"] == "FAILED", response["Reason"]
+        assert "membership cycle" in response["Reason"]
+
+        request = Request("Update", None, None, "grants:postgres:Whatever", memberships[1:])
+        request["OldResourceProperties"] = {"Memberships": memberships}
+        response = handler(request, {})
+        assert response["Status"] == "SUCCESS", response["Reason"]
+        assert get_memberships(r, [readonly, readwrite, app]) == {(readonly, readwrite), (readonly, app)}
+
+        request = Request("Delete", None, None, "grants:postgres:Whatever", memberships[1:])
+        response = handler(request, {})
+        assert response["Status"] == "SUCCESS", response["Reason"]
+        assert get_memberships(r, [readonly, readwrite, app]) == set()
+    finally:
+        with r.db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("DROP ROLE %s", [AsIs(app)])
+            connection.commit()
+
+
+def test_grant_memberships_of_noinherit_role(pg_users):
+    readonly, readwrite = pg_users
+    app = readwrite.replace("user2_", "app_")
+    r = Request("Create", readonly, readwrite)
+    with r.db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE ROLE %s", [AsIs(app)])
+            cursor.execute("ALTER ROLE %s NOINHERIT", [AsIs(readwrite)])
+        connection.commit()
+    try:
+        # app does not inherit the privileges of readonly through readwrite
+        memberships = [
+            {"Role": readwrite, "Grantee": app},
+            {"Role": readonly, "Grantee": readwrite},
+            {"Role": readonly, "Grantee": app},
+        ]
+        request = Request("Create", None, None, memberships=memberships)
+        response = handler(request, {})
+        assert response["Status"] == "SUCCESS", response["Reason"]
+        assert get_memberships(r, [readonly, readwrite, app]) == {
+            (readwrite, app), (readonly, readwrite), (readonly, app)
+        }
+
+        request = Request("Delete", None, None, response["PhysicalResourceId"], memberships)
+        response = handler(request, {})
+        assert response["Status"] == "SUCCESS", response["Reason"]
+        assert get_memberships(r, [readonly, readwrite, app]) == set()
+    finally:
+        with r.db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("DROP ROLE %s", [AsIs(app)])
+            connection.commit()
+
+
+def test_change_single_grant_to_memberships(pg_users):
+    readonly, readwrite = pg_users
+    r = Request("Create", readonly, readwrite)
+    response = handler(r, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    physical_resource_id = response["PhysicalResourceId"]
+
+    # the physical resource id is kept, so that CloudFormation does not delete the single grant
+    memberships = [{"Role": readonly, "Grantee": readwrite}]
+    request = Request("Update", None, None, physical_resource_id, memberships)
+    request["OldResourceProperties"] = {"Role": readonly, "Grantee": readwrite}
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert response["PhysicalResourceId"] == physical_resource_id
+    assert get_memberships(r, [readonly, readwrite]) == {(readonly, readwrite)}
+
+    # and back
+    request = Request("Update", readonly, readwrite, physical_resource_id)
+    request["OldResourceProperties"] = {"Memberships": memberships}
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert response["PhysicalResourceId"] == physical_resource_id
+    assert get_memberships(r, [readonly, readwrite]) == {(readonly, readwrite)}
+
+    request = Request("Delete", readonly, readwrite, physical_resource_id)
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert get_memberships(r, [readonly, readwrite]) == set()
+
+
+def get_memberships(request, roles):
+    with request.db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT r.rolname, m.rolname FROM pg_auth_members a "
+                "JOIN pg_roles r ON r.oid = a.roleid JOIN pg_roles m ON m.oid = a.member "
+                "WHERE r.rolname = ANY(%s) AND m.rolname = ANY(%s)",
+                [roles, roles],
+            )
+            return set(cursor.fetchall())
+
+
 @pytest.fixture
 def pg_users():
     uid = str(uuid.uuid4()).replace("-", "")
@@ -51,7 +173,7 @@ def pg_users():
 
 
 class Request(dict):
-    def __init__(self, request_type, role, grantee, physical_resource_id=None):
+    def __init__(self, request_type, role, grantee, physical_resource_id=None, memberships=None):
         self.update(
             {
                 "RequestType": request_type,
@@ -75,6 +197,10 @@ class Request(dict):
         )
         if physical_resource_id is not None:
             self["PhysicalResourceId"] = physical_resource_id
+        if memberships is not None:
+            properties = self["ResourceProperties"]
+            del properties["Role"], properties["Grantee"]
+            properties["Memberships"] = memberships
 
     def db_connection(self):
         p = self["ResourceProperties"]
@@ -1,3 +1,4 @@
+import json
 import logging
 import uuid
 
@@ -35,6 +36,170 @@ def test_create_schema(pg_users):
     response = handler(request, {})
     assert response["Status"] == "SUCCESS", response["Reason"]
 
+def test_lock_wait_budget(pg_users):
+    user1, user2 = pg_users
+    schema = "schema_{}".format(str(uuid.uuid4()).replace("-", ""))
+    request = Request("Create", schema, user1)
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    physical_resource_id = response["PhysicalResourceId"]
+
+    request = Request("Delete", schema, user1, physical_resource_id)
+    request["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    request["ResourceProperties"]["Database"].update({"LockTimeout": 100, "LockWaitBudget": 1})
+    with request.db_connection() as connection:
+        with connection.cursor() as cursor:
+            # an application transaction reading from a table in the schema
+            cursor.execute("CREATE TABLE %s.t (id integer)", [AsIs(schema)])
+            connection.commit()
+            cursor.execute("SELECT * FROM %s.t", [AsIs(schema)])
+
+            response = handler(request, {})
+            assert response["Status"] == "FAILED", response["Reason"]
+            assert "gave up waiting for locks" in response["Reason"]
+        connection.rollback()
+
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+
+
+def test_transfer_ownership(pg_users, monkeypatch):
+    import postgresql_schema_provider
+
+    user1, user2 = pg_users
+    schema = "schema_{}".format(str(uuid.uuid4()).replace("-", ""))
+    request = Request("Create", schema, user1)
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    physical_resource_id = response["PhysicalResourceId"]
+
+    with request.db_connection() as connection:
+        with connection.cursor() as cursor:
+            # an object of another owner is not transferred
+            cursor.execute("CREATE FUNCTION %s.other() RETURNS integer LANGUAGE sql AS 'SELECT 1'", [AsIs(schema)])
+            cursor.execute("SET ROLE %s", [AsIs(user1)])
+            cursor.execute(
+                """
+                SET search_path = %(schema)s;
+                CREATE TABLE t1 (id serial PRIMARY KEY, name text);
+                CREATE TABLE "t%%2" (id integer GENERATED ALWAYS AS IDENTITY);
+                CREATE VIEW v1 AS SELECT * FROM t1;
+                CREATE MATERIALIZED VIEW m1 AS SELECT * FROM t1;
+                CREATE SEQUENCE s1;
+                CREATE TYPE e1 AS ENUM ('a', 'b');
+                CREATE TYPE c1 AS (a integer, b text);
+                CREATE DOMAIN d1 AS integer CHECK (VALUE > 0);
+                CREATE FUNCTION f1(a integer, b text) RETURNS integer LANGUAGE sql AS 'SELECT a';
+                CREATE PROCEDURE p1() LANGUAGE sql AS 'SELECT 1';
+                CREATE AGGREGATE a1(integer) (SFUNC = int4pl, STYPE = integer);
+                """.replace("%(schema)s", schema)
+            )
+        connection.commit()
+
+    # the ownership transfer continues in a new invocation, when the lambda runs out of time
+    invocations = []
+
+    class LambdaClient(object):
+        def invoke(self, FunctionName, InvocationType, Payload):
+            invocations.append(json.loads(Payload))
+
+    class Context(object):
+        invoked_function_arn = "arn:aws:lambda:eu-central-1:123456789012:function:provider"
+
+        def __init__(self, remaining):
+            self.remaining = remaining
+
+        def get_remaining_time_in_millis(self):
+            self.remaining -= 1000
+            return self.remaining
+
+    monkeypatch.setattr(postgresql_schema_provider.provider, "_lambda_client", LambdaClient(), raising=False)
+    request = Request("Update", schema, user2, physical_resource_id)
+    request["OldResourceProperties"] = {"Schema": schema, "Owner": user1}
+    request["ResourceProperties"].update({"TransferOwnership": True, "OwnershipBatchSize": 3})
+    response = handler(request, Context(13000))
+    assert len(invocations) == 1
+    assert invocations[0]["OwnershipTransferInvocation"] == 1
+    assert len(get_object_owners(request, schema, user2)) > 0
+
+    response = handler(invocations[0], Context(600000))
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert len(invocations) == 1
+    assert get_object_owners(request, schema, user2) == ["other"]
+
+    request = Request("Delete", schema, user2, physical_resource_id)
+    request["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+
+
+def test_transfer_ownership_unchanged_owner(pg_users, monkeypatch):
+    import postgresql_schema_provider
+
+    user1, _ = pg_users
+    schema = "schema_{}".format(str(uuid.uuid4()).replace("-", ""))
+    request = Request("Create", schema, user1)
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    physical_resource_id = response["PhysicalResourceId"]
+
+    with request.db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SET ROLE %s", [AsIs(user1)])
+            cursor.execute("CREATE TABLE %s.t1 (id integer)", [AsIs(schema)])
+        connection.commit()
+
+    # an update which does not change the owner, does not lock the objects in the schema
+    provider = postgresql_schema_provider.provider
+    statements = []
+    execute_statement = provider.execute_statement
+
+    def recording_execute_statement(statement, *args, **kwargs):
+        statements.append(statement)
+        return execute_statement(statement, *args, **kwargs)
+
+    monkeypatch.setattr(provider, "execute_statement", recording_execute_statement)
+    request = Request("Update", schema, user1, physical_resource_id)
+    request["OldResourceProperties"] = {"Schema": schema, "Owner": user1}
+    request["ResourceProperties"]["TransferOwnership"] = True
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert [s for s in statements if "OWNER" in s] == []
+
+    request = Request("Update", schema, user1, physical_resource_id)
+    request["OldResourceProperties"] = {"Schema": schema, "Owner": user1}
+    request["ResourceProperties"]["TransferOwnership"] = True
+    request["OwnershipTransferInvocation"] = 1
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert [s for s in statements if "OWNER" in s] == []
+
+    request = Request("Delete", schema, user1, physical_resource_id)
+    request["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    response = handler(request, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+
+
+def get_object_owners(request, schema, owner):
+    # returns the objects in the schema not owned by owner
+    with request.db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                 WHERE n.nspname = %(schema)s AND c.relowner <> %(owner)s::regrole
+                UNION ALL
+                SELECT p.proname FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+                 WHERE n.nspname = %(schema)s AND p.proowner <> %(owner)s::regrole
+                UNION ALL
+                SELECT t.typname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+                 WHERE n.nspname = %(schema)s AND t.typowner <> %(owner)s::regrole
+                """,
+                {"schema": schema, "owner": owner},
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
 @pytest.fixture
 def pg_users():
     uid = str(uuid.uuid4()).replace("-", "")
@@ -2,8 +2,11 @@ import sys, json
 import uuid
 import psycopg2
 import boto3
+import pytest
+from psycopg2.extensions import AsIs
 import logging
 from postgresql_user_provider import handler, request_schema
+import postgresql
 
 logging.basicConfig(level=logging.INFO)
 
@@ -190,6 +193,373 @@ def test_create_database():
             assert len(rows) == 0, 'database %s still exists' % name
 
 
+def test_drop_database_with_schema():
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=True)
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    # a schema in the database of the user, which leaves an idle connection to it in the pool
+    schema = {
+        'RequestType': 'Create',
+        'ResponseURL': 'https://httpbin.org/put',
+        'StackId': 'arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid',
+        'RequestId': 'request-%s' % str(uuid.uuid4()),
+        'ResourceType': 'Custom::PostgreSQLSchema',
+        'LogicalResourceId': 'Schema',
+        'ResourceProperties': {
+            'Schema': 'app', 'Owner': name,
+            'Database': dict(event['ResourceProperties']['Database'], DBName=name)
+        }}
+    response = postgresql.handler(schema, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    schema.update({'RequestType': 'Delete', 'RequestId': 'request-%s' % str(uuid.uuid4()),
+                   'PhysicalResourceId': response['PhysicalResourceId']})
+    response = postgresql.handler(schema, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+    event = Event('Delete', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def test_drop_database_with_idle_connection_of_other_container():
+    import warmup
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=True)
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    # an idle pooled connection of the provider in another warm container
+    p = event['ResourceProperties']['Database']
+    other = psycopg2.connect(host=p['Host'], port=p['Port'], dbname=name, user=p['User'], password=p['Password'],
+                             application_name=warmup.application_name)
+    try:
+        event = Event('Delete', name, physical_resource_id, with_database=True)
+        event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+        response = handler(event, {})
+        assert response['Status'] == 'SUCCESS', response['Reason']
+        with pytest.raises(psycopg2.OperationalError):
+            with other.cursor() as cursor:
+                cursor.execute('SELECT 1')
+    finally:
+        other.close()
+
+
+def test_database_settings():
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=True)
+    event['ResourceProperties']['DatabaseSettings'] = {'work_mem': '64MB', 'random_page_cost': '1.1'}
+    event['ResourceProperties']['Tablespace'] = 'pg_default'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+    assert get_database_settings(event, name) == {'work_mem': '64MB', 'random_page_cost': '1.1'}
+
+    event = Event('Update', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['DatabaseSettings'] = {'work_mem': '128MB', 'enable_seqscan': 'false'}
+    event['OldResourceProperties'] = {'DatabaseSettings': {'work_mem': '64MB', 'random_page_cost': '1.1'}}
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert get_database_settings(event, name) == {'work_mem': '128MB', 'enable_seqscan': 'false'}
+
+    event = Event('Delete', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def test_seed(tmp_path):
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    script = tmp_path / 'schema.sql'
+    script.write_text(
+        "CREATE TABLE country (code char(2) PRIMARY KEY, name text);\n"
+        "CREATE FUNCTION country_name(c char(2)) RETURNS text LANGUAGE plpgsql AS $$\n"
+        "BEGIN\n"
+        "  RETURN (SELECT name FROM country WHERE code = c);\n"
+        "END;\n"
+        "$$;\n"
+        "\n"
+        "COPY country (code, name) FROM stdin;\n"
+        "NL\tNetherlands\n"
+        "DE\tGermany; Deutschland\n"
+        "\\.\n"
+        "INSERT INTO country VALUES ('FR', '100% France');\n"
+    )
+    data = tmp_path / 'country.csv'
+    data.write_text('code,name\nBE,Belgium\n')
+
+    event = Event('Create', name, with_database=True)
+    event['ResourceProperties']['Seed'] = [
+        {'Location': str(script)},
+        {'Location': str(data), 'Table': 'public.country'},
+    ]
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+    assert get_countries(event, name) == [
+        ('BE', 'Belgium', name), ('DE', 'Germany; Deutschland', name), ('FR', '100% France', name),
+        ('NL', 'Netherlands', name)]
+
+    # artifacts which are already loaded are skipped
+    data.write_text('code,name\nLU,Luxembourg\n')
+    event = Event('Update', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['Seed'] = [
+        {'Location': str(script)},
+        {'Location': str(data), 'Table': 'country'},
+    ]
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert [c[0] for c in get_countries(event, name)] == ['BE', 'DE', 'FR', 'LU', 'NL']
+
+    event = Event('Delete', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def test_seed_pg_dump(tmp_path):
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    script = tmp_path / 'dump.sql'
+    script.write_text(
+        "--\n"
+        "-- PostgreSQL database dump\n"
+        "--\n"
+        "\n"
+        "SET client_encoding = 'UTF8';\n"
+        "\n"
+        "--\n"
+        "-- Name: country; Type: TABLE; Schema: public; Owner: -\n"
+        "--\n"
+        "\n"
+        "CREATE TABLE country (code char(2) PRIMARY KEY, name text);\n"
+        "CREATE FUNCTION country_name(c char(2)) RETURNS text LANGUAGE sql AS $$\n"
+        "  SELECT name FROM country WHERE code = c\n"
+        "$$;\n"
+        "\n"
+        "--\n"
+        "-- Data for Name: country; Type: TABLE DATA; Schema: public; Owner: -\n"
+        "--\n"
+        "\n"
+        "COPY public.country (code, name) FROM stdin;\n"
+        "NL\tNetherlands\n"
+        "DE\tGermany\n"
+        "\\.\n"
+        "\n"
+        "\n"
+        "--\n"
+        "-- PostgreSQL database dump complete\n"
+        "--\n"
+        "\n"
+    )
+
+    event = Event('Create', name, with_database=True)
+    event['ResourceProperties']['Seed'] = [{'Location': str(script)}]
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+    assert get_countries(event, name) == [('DE', 'Germany', name), ('NL', 'Netherlands', name)]
+
+    event = Event('Delete', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def get_countries(event, name):
+    event['ResourceProperties']['Database']['DBName'] = name
+    connection = event.test_owner_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT c.code, country_name(c.code), t.tableowner FROM country c "
+                           "JOIN pg_tables t ON t.tablename = 'country' ORDER BY 1")
+            return cursor.fetchall()
+    finally:
+        connection.close()
+        event['ResourceProperties']['Database']['DBName'] = 'postgres'
+
+
+def test_password_iterations():
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name)
+    event['ResourceProperties']['PasswordIterations'] = 1000
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+    verifier = get_password_verifier(event, name)
+    assert verifier.startswith('SCRAM-SHA-256$1000:')
+    event.test_user_connection().close()
+
+    # the password is set on every update, with a new salt
+    event = Event('Update', name, physical_resource_id)
+    event['ResourceProperties']['PasswordIterations'] = 1000
+    event['ResourceProperties']['Password'] = 'new-password'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert get_password_verifier(event, name) != verifier
+    event.test_user_connection().close()
+
+    event = Event('Delete', name, physical_resource_id)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def get_password_verifier(event, name):
+    connection = event.test_owner_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rolpassword FROM pg_authid WHERE rolname = %s', [name])
+            return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_drop_user_owning_objects():
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    other = 'd%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=False)
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    connection = event.test_owner_connection()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE DATABASE %s', [AsIs(other)])
+        cursor.execute('CREATE TABLE %s (id integer)', [AsIs(name)])
+        cursor.execute('ALTER TABLE %s OWNER TO %s', [AsIs(name), AsIs(name)])
+
+    other_event = Event('Create', name)
+    other_event['ResourceProperties']['Database']['DBName'] = other
+    other_connection = other_event.test_owner_connection()
+    with other_connection.cursor() as cursor:
+        cursor.execute('CREATE SCHEMA %s AUTHORIZATION %s', [AsIs(name), AsIs(name)])
+        cursor.execute('GRANT CONNECT ON DATABASE %s TO %s', [AsIs(other), AsIs(name)])
+    other_connection.commit()
+    other_connection.close()
+
+    event = Event('Delete', name, physical_resource_id)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    event['ResourceProperties']['ReassignOwnedTo'] = 'postgres'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_catalog.pg_roles WHERE rolname = %s', [name])
+        assert cursor.fetchall() == [], 'role %s was not dropped' % name
+        cursor.execute('DROP TABLE %s', [AsIs(name)])
+        cursor.execute('DROP DATABASE %s', [AsIs(other)])
+    connection.close()
+
+
+def test_redelivered_request():
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=False)
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    # the redelivered request is answered without connecting to the database
+    redelivered = Event('Create', name, with_database=False)
+    redelivered['RequestId'] = event['RequestId']
+    redelivered['ResourceProperties']['Database']['Password'] = 'wrong'
+    response = handler(redelivered, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] == physical_resource_id
+
+    event = Event('Delete', name, physical_resource_id)
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def test_pooler_mode(monkeypatch):
+    import postgresql_user_provider
+    import warmup
+    provider = postgresql_user_provider.provider
+    connects, statements = [], []
+
+    connect = warmup.connect
+
+    def recording_connect(connect_info):
+        connection = connect(connect_info)
+        connects.append((connect_info['host'], connection))
+        return connection
+
+    execute_statement = provider.execute_statement
+
+    def recording_execute_statement(statement, args=None, connection=None, transaction=True):
+        statements.append((statement, connection if connection is not None else provider.connection))
+        return execute_statement(statement, args, connection, transaction)
+
+    monkeypatch.setattr(warmup, 'connect', recording_connect)
+    monkeypatch.setattr(provider, 'execute_statement', recording_execute_statement)
+
+    def direct_connections():
+        return [c for host, c in connects if host == '127.0.0.1']
+
+    def connection_of(prefix):
+        return [c for statement, c in statements if statement.startswith(prefix)]
+
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=True)
+    event['ResourceProperties']['Database'].update({'Pooler': True, 'DirectHost': '127.0.0.1', 'DirectPort': 5432})
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+    assert physical_resource_id == 'postgresql:localhost:5432:postgres:%(name)s:%(name)s' % {'name': name}
+
+    # the database is created over a connection of its own to the DirectHost, not through the pooler
+    assert len(direct_connections()) == 1
+    assert connection_of('CREATE DATABASE') == direct_connections()
+    assert connection_of('CREATE ROLE')[0] not in direct_connections()
+
+    event = Event('Delete', name, physical_resource_id, with_database=True)
+    event['ResourceProperties']['Database'].update({'Pooler': True, 'DirectHost': '127.0.0.1', 'DirectPort': 5432})
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert len(direct_connections()) == 2
+    assert connection_of('DROP DATABASE') == direct_connections()[1:]
+
+    # a user without a database does not connect directly
+    del connects[:]
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name)
+    event['ResourceProperties']['Database'].update({'Pooler': True, 'DirectHost': '127.0.0.1', 'DirectPort': 5432})
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert direct_connections() == []
+
+    event = Event('Delete', name, response['PhysicalResourceId'])
+    event['ResourceProperties']['DeletionPolicy'] = 'Drop'
+    response = handler(event, {})
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def test_pooler_requires_direct_host():
+    name = 'u%s' % str(uuid.uuid4()).replace('-', '')
+    event = Event('Create', name, with_database=True)
+    event['ResourceProperties']['Database'].update({'Pooler': True})
+    response = handler(event, {})
+    assert response['Status'] == 'FAILED', response['Reason']
+    assert response['Reason'].startswith('invalid resource properties'), response['Reason']
+
+
+def get_database_settings(event, name):
+    with event.test_owner_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT unnest(s.setconfig) FROM pg_catalog.pg_db_role_setting s "
+                "JOIN pg_catalog.pg_database d ON d.oid = s.setdatabase "
+                "WHERE s.setrole = 0 AND d.datname = %s", [name])
+            return dict(row[0].split('=', 1) for row in cursor.fetchall())
+
+
 def test_invalid_delete():
     event = Event('Delete', "noop", 'postgresql:localhost:5432:postgres:%(name)s:%(name)s' % {'name': 'noop'})
     del event['ResourceProperties']['User']
@@ -197,6 +567,55 @@ def test_invalid_delete():
     assert response['Status'] == 'SUCCESS', response['Reason']
 
 
+class FakeRds(object):
+    def __init__(self):
+        self.calls = []
+
+    def generate_db_auth_token(self, DBHostname, Port, DBUsername):
+        self.calls.append((DBHostname, Port, DBUsername))
+        return 'token-%d-%s-%s-%s' % (len(self.calls), DBHostname, Port, DBUsername)
+
+
+def test_iam_token_cache(monkeypatch):
+    import postgresql_user_provider
+    now = [1000.0]
+    monkeypatch.setattr(postgresql_user_provider.time, 'time', lambda: now[0])
+    provider = postgresql_user_provider.PostgreSQLUser()
+    provider.rds = FakeRds()
+
+    # a token is generated once per host, port and user
+    token = provider.get_iam_token('db1', 5432, 'owner')
+    assert token == 'token-1-db1-5432-owner'
+    assert provider.get_iam_token('db1', 5432, 'owner') == token
+    assert provider.get_iam_token('db2', 5432, 'owner') == 'token-2-db2-5432-owner'
+    assert provider.get_iam_token('db1', 5433, 'owner') == 'token-3-db1-5433-owner'
+    assert provider.get_iam_token('db1', 5432, 'other') == 'token-4-db1-5432-other'
+    assert len(provider.rds.calls) == 4
+
+    # and refreshed shortly before it expires
+    lifetime = postgresql_user_provider.iam_token_lifetime - postgresql_user_provider.iam_token_refresh_margin
+    now[0] = 1000.0 + lifetime - 1
+    assert provider.get_iam_token('db1', 5432, 'owner') == token
+    now[0] = 1000.0 + lifetime
+    assert provider.get_iam_token('db1', 5432, 'owner') == 'token-5-db1-5432-owner'
+    assert provider.rds.calls[-1] == ('db1', 5432, 'owner')
+
+
+def test_iam_connect_info():
+    import postgresql_user_provider
+    provider = postgresql_user_provider.PostgreSQLUser()
+    provider.rds = FakeRds()
+
+    database = {'Host': 'db1', 'Port': 5433, 'DBName': 'postgres', 'User': 'owner', 'IamAuth': True}
+    connect_info = provider.connect_info_of('db1', database)
+    assert connect_info == {'host': 'db1', 'port': 5433, 'dbname': 'postgres', 'user': 'owner',
+                            'password': 'token-1-db1-5433-owner', 'connect_timeout': 2, 'sslmode': 'require'}
+
+    database = {'Host': 'db1', 'Port': 5433, 'DBName': 'postgres', 'User': 'owner', 'Password': 'password'}
+    assert 'sslmode' not in provider.connect_info_of('db1', database)
+    assert provider.rds.calls == [('db1', 5433, 'owner')]
+
+
 def test_password_parameter_use():
     ssm = boto3.client('ssm')
     uuid_string = str(uuid.uuid4()).replace('-', '')
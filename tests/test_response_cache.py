@@ -0,0 +1,55 @@
+from response_cache import ResponseCache
+
+
+def request(request_id, logical_resource_id="Whatever"):
+    return {
+        "RequestType": "Create",
+        "StackId": "arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid",
+        "RequestId": request_id,
+        "ResourceType": "Custom::PostgreSQLUser",
+        "LogicalResourceId": logical_resource_id,
+    }
+
+
+def test_hit_and_miss():
+    cache = ResponseCache(maxsize=2, ttl=60)
+    key = cache.key(request("request-1"))
+    assert cache.get(key) is None
+
+    cache.put(key, {"Status": "SUCCESS", "PhysicalResourceId": "p1", "Data": {}})
+    response = cache.get(key)
+    assert response == {"Status": "SUCCESS", "PhysicalResourceId": "p1", "Data": {}}
+
+    # the cached response cannot be changed through the returned copy
+    response["Data"]["x"] = 1
+    assert cache.get(key)["Data"] == {}
+
+    assert cache.get(cache.key(request("request-1", "Other"))) is None
+    assert cache.stats == {"size": 1, "hits": 2, "misses": 2, "expirations": 0, "evictions": 0}
+
+
+def test_expiry(clock):
+    cache = ResponseCache(maxsize=2, ttl=60, clock=clock)
+    key = cache.key(request("request-1"))
+    cache.put(key, {"Status": "SUCCESS"})
+
+    clock.now = 59
+    assert cache.get(key) is not None
+    clock.now = 60
+    assert cache.get(key) is None
+    assert cache.stats["expirations"] == 1
+    assert cache.stats["size"] == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(maxsize=2, ttl=60)
+    keys = [cache.key(request("request-%d" % i)) for i in range(3)]
+    cache.put(keys[0], {"Status": "SUCCESS"})
+    cache.put(keys[1], {"Status": "SUCCESS"})
+    assert cache.get(keys[0]) is not None
+
+    cache.put(keys[2], {"Status": "SUCCESS"})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats["evictions"] == 1
@@ -0,0 +1,104 @@
+import random
+import time
+
+import pytest
+
+from role_graph import RoleGraph
+
+
+def test_closure():
+    graph = RoleGraph([("readwrite", "app"), ("readonly", "readwrite"), ("readonly", "report")])
+    closure = graph.closure()
+    assert closure["app"] == {"readwrite", "readonly"}
+    assert closure["report"] == {"readonly"}
+    assert closure["readonly"] == set()
+    assert graph.is_member("app", "readonly")
+    assert not graph.is_member("report", "readwrite")
+
+
+def test_reduction():
+    graph = RoleGraph([("readwrite", "app"), ("readonly", "readwrite"), ("readonly", "app")])
+    assert graph.reduction().memberships == {("readwrite", "app"), ("readonly", "readwrite")}
+
+
+def test_reduction_keeps_memberships_through_noinherit_members():
+    memberships = [("readwrite", "app"), ("readonly", "readwrite"), ("readonly", "app")]
+    graph = RoleGraph(memberships, noinherit=[("readonly", "readwrite")])
+    assert graph.reduction().memberships == set(memberships)
+
+    graph = RoleGraph(memberships, noinherit=[("readwrite", "app")])
+    assert graph.reduction().memberships == set(memberships)
+
+    # a membership which does not inherit itself, is still implied by a path which does
+    graph = RoleGraph(memberships, noinherit=[("readonly", "app")])
+    assert graph.reduction().memberships == {("readwrite", "app"), ("readonly", "readwrite")}
+
+
+def test_find_cycle():
+    assert RoleGraph([("b", "a"), ("c", "b")]).find_cycle() is None
+    assert RoleGraph([("b", "a"), ("c", "b"), ("a", "c")]).find_cycle() in (
+        ["a", "b", "c", "a"],
+        ["b", "c", "a", "b"],
+        ["c", "a", "b", "c"],
+    )
+    with pytest.raises(ValueError):
+        RoleGraph([("b", "a"), ("a", "b")]).closure()
+
+
+def test_plan_grants_only_minimal_set():
+    existing = RoleGraph([("readonly", "readwrite")])
+    desired = [("readwrite", "app"), ("readonly", "app"), ("readonly", "readwrite")]
+    grants, revokes = existing.plan(desired)
+    assert grants == [("readwrite", "app")]
+    assert revokes == []
+
+
+def test_plan_grants_memberships_of_noinherit_members():
+    existing = RoleGraph([("readonly", "readwrite")], [("readonly", "readwrite")], ["readwrite"])
+    desired = [("readwrite", "app"), ("readonly", "app"), ("readonly", "readwrite")]
+    grants, revokes = existing.plan(desired)
+    assert grants == [("readonly", "app"), ("readwrite", "app")]
+    assert revokes == []
+
+    # an existing membership which inherits, of a role which no longer does by default
+    existing = RoleGraph([("readonly", "readwrite")], noinherit_members=["readwrite"])
+    grants, revokes = existing.plan(desired)
+    assert grants == [("readwrite", "app")]
+
+
+def test_plan_revokes_managed_memberships_no_longer_desired():
+    existing = RoleGraph([("readonly", "readwrite"), ("readonly", "app"), ("readonly", "report")])
+    managed = [("readonly", "app"), ("readonly", "report")]
+    desired = [("readwrite", "app"), ("readonly", "app"), ("readonly", "readwrite")]
+    grants, revokes = existing.plan(desired, managed)
+    assert grants == [("readwrite", "app")]
+    # the declared membership of app in readonly is implied, but kept
+    assert revokes == [("readonly", "report")]
+
+
+def test_plan_detects_cycles():
+    existing = RoleGraph([("readwrite", "app"), ("readonly", "readwrite")])
+    with pytest.raises(ValueError) as e:
+        existing.plan([("app", "readonly")])
+    assert "membership cycle" in str(e.value)
+
+    # no cycle, if the membership closing the cycle is revoked
+    grants, revokes = existing.plan([("app", "readonly")], managed=[("readwrite", "app")])
+    assert grants == [("app", "readonly")]
+    assert revokes == [("readwrite", "app")]
+
+
+def test_scales_to_many_roles():
+    rng = random.Random(42)
+    tenants = 20000
+    memberships = [("readonly_%d" % (i % 100), "readwrite_%d" % (i % 100)) for i in range(100)]
+    for i in range(tenants):
+        memberships.append(("readwrite_%d" % rng.randrange(100), "app_%d" % i))
+        memberships.append(("readonly_%d" % rng.randrange(100), "app_%d" % i))
+    graph = RoleGraph(memberships)
+
+    started = time.monotonic()
+    reduced = graph.reduction()
+    assert graph.find_cycle() is None
+    assert time.monotonic() - started < 10
+    assert len(reduced.memberships) < len(graph.memberships)
@@ -0,0 +1,37 @@
+import base64
+
+import psycopg2
+from psycopg2.extensions import encrypt_password
+
+import scram
+
+
+def test_verifier_matches_libpq():
+    connection = psycopg2.connect(host="localhost", port=5432, dbname="postgres", user="postgres", password="password")
+    try:
+        passwords = ["password", "p@ss w0rd!", "p\u00e4ssw\u00f6rd", "I\u00a0X"]
+        # a right-to-left password, and passwords which violate the bidirectional rules
+        passwords += ["\u05d0\ufb21\u05d1", "\u05d0\ufb21abc\u05d2", "abc\ufb21"]
+        for password in passwords:
+            expected = encrypt_password(password, "user", connection, "scram-sha-256")
+            iterations, salt = expected.split("$")[1].split(":")
+            assert scram.verifier(password, int(iterations), base64.b64decode(salt)) == expected
+    finally:
+        connection.close()
+
+
+def test_verifier_format():
+    verifier = scram.verifier("password", 1000)
+    assert verifier.startswith("SCRAM-SHA-256$1000:")
+    assert verifier != scram.verifier("password", 1000)
+
+
+def test_saslprep():
+    assert scram.saslprep("password") == "password"
+    # a non-ASCII space is mapped to a space, and a soft hyphen to nothing
+    assert scram.saslprep("I X­") == "I X"
+    # a password with prohibited characters is used as is
+    assert scram.saslprep("a\u0007b ") == "a\u0007b "
+    # as is a password which mixes right-to-left and left-to-right characters
+    assert scram.saslprep("\u05d0\ufb21abc") == "\u05d0\ufb21abc"
+    assert scram.saslprep("\u05d0\ufb21\u05d1") == "\u05d0\u05d0\u05d1"
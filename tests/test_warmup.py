@@ -0,0 +1,162 @@
+import json
+import logging
+
+import uuid
+
+import psycopg2
+import pytest
+
+import warmup
+from postgresql import handler
+from test_postgresql_user_provider import Event
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_dns_cache(clock):
+    cache = warmup.DNSCache(ttl=60, clock=clock)
+    address = cache.resolve("localhost", 5432)
+    assert address in ["127.0.0.1", "::1"]
+
+    cache.entries["localhost"] = ("10.0.0.1", 60)
+    assert cache.resolve("localhost", 5432) == "10.0.0.1"
+
+    clock.now = 60
+    assert cache.resolve("localhost", 5432) == address
+
+    assert cache.invalidate("localhost")
+    assert not cache.invalidate("localhost")
+
+
+def test_prefetch(monkeypatch):
+    database = {"Host": "localhost", "Port": 5432, "DBName": "postgres", "User": "postgres", "Password": "password"}
+    monkeypatch.setenv("WARMUP_DATABASES", json.dumps([database]))
+    monkeypatch.setattr(warmup, "pool", warmup.ConnectionPool())
+    warmup.prefetch(None, None)
+
+    key = ("localhost", 5432, "postgres", "postgres")
+    connection = warmup.pool.take(key)
+    assert connection is not None
+    assert warmup.pool.take(key) is None
+
+    # a closed connection is not handed out
+    connection.close()
+    warmup.pool.give(key, connection)
+    assert warmup.pool.take(key) is None
+
+
+def test_prefetch_failures(monkeypatch, caplog):
+    monkeypatch.setattr(warmup, "pool", warmup.ConnectionPool())
+    connects = []
+
+    def failing_connect(connect_info):
+        connects.append(connect_info)
+        raise psycopg2.OperationalError("timeout expired")
+
+    # a malformed list of databases is ignored
+    monkeypatch.setenv("WARMUP_DATABASES", "[{")
+    warmup.prefetch(None, None)
+    assert "failed to parse WARMUP_DATABASES" in caplog.text
+
+    # an unreachable database gives up after the connect timeout
+    database = {"Host": "10.255.255.1", "Port": 5432, "DBName": "postgres", "User": "postgres", "Password": "password"}
+    monkeypatch.setenv("WARMUP_DATABASES", json.dumps([database]))
+    monkeypatch.setattr(warmup, "connect", failing_connect)
+    warmup.prefetch(None, None)
+    assert [c["connect_timeout"] for c in connects] == [warmup.connect_timeout]
+    assert "failed to warm up connection to 10.255.255.1" in caplog.text
+    assert warmup.pool.connections == {}
+
+
+def test_stale_address_is_resolved_again(monkeypatch):
+    monkeypatch.setattr(warmup, "pool", warmup.ConnectionPool())
+    warmup.dns.entries["localhost"] = ("127.0.0.2", float("inf"))
+
+    name = "u%s" % str(uuid.uuid4()).replace("-", "")
+    event = Event("Create", name)
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert warmup.dns.entries["localhost"][0] != "127.0.0.2"
+
+    event = Event("Delete", name, response["PhysicalResourceId"])
+    event["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+
+
+def test_connect_primary(monkeypatch):
+    monkeypatch.setattr(warmup, "primaries", {})
+
+    def connect_info_of(host):
+        result = {"host": "localhost", "port": 5432, "dbname": "postgres", "user": "postgres", "password": "password"}
+        if host == "standby":
+            result["options"] = "-c default_transaction_read_only=on"
+        elif host == "down":
+            result["host"] = "127.0.0.2"
+        return result
+
+    hosts = ["down", "standby", "primary"]
+    connection = warmup.connect_primary(hosts, connect_info_of, 2)
+    assert warmup.is_read_write(connection)
+    assert warmup.primaries[tuple(hosts)] == "primary"
+    connection.close()
+
+    # after a failover, the former primary is read-only
+    hosts = ["primary", "standby"]
+    warmup.primaries[tuple(hosts)] = "standby"
+    connection = warmup.connect_primary(hosts, connect_info_of, 2)
+    assert warmup.primaries[tuple(hosts)] == "primary"
+    connection.close()
+
+    with pytest.raises(psycopg2.OperationalError) as e:
+        warmup.connect_primary(["down", "standby"], connect_info_of, 2)
+    assert "standby: read-only" in str(e.value)
+    assert ("down", "standby") not in warmup.primaries
+
+
+def test_multiple_hosts(monkeypatch):
+    monkeypatch.setattr(warmup, "pool", warmup.ConnectionPool())
+    monkeypatch.setattr(warmup, "primaries", {})
+
+    name = "u%s" % str(uuid.uuid4()).replace("-", "")
+    event = Event("Create", name)
+    event["ResourceProperties"]["Database"]["Host"] = ["127.0.0.2", "localhost"]
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+    assert response["PhysicalResourceId"] == "postgresql:127.0.0.2,localhost:5432:postgres::%s" % name
+    assert warmup.primaries[("127.0.0.2", "localhost")] == "localhost"
+    physical_resource_id = response["PhysicalResourceId"]
+
+    # the hosts of the cluster can be reordered, added and removed
+    for host in [["localhost", "127.0.0.2"], "localhost", ["localhost", "127.0.0.3"]]:
+        event = Event("Update", name, physical_resource_id)
+        event["ResourceProperties"]["Database"]["Host"] = host
+        response = handler(event, {})
+        assert response["Status"] == "SUCCESS", response["Reason"]
+        assert response["PhysicalResourceId"] == physical_resource_id
+
+    event = Event("Update", name, physical_resource_id)
+    event["ResourceProperties"]["Database"]["Host"] = "127.0.0.1"
+    response = handler(event, {})
+    assert response["Status"] == "FAILED"
+
+    event = Event("Delete", name, response["PhysicalResourceId"])
+    event["ResourceProperties"]["Database"]["Host"] = "127.0.0.2, localhost"
+    event["ResourceProperties"]["DeletionPolicy"] = "Drop"
+    response = handler(event, {})
+    assert response["Status"] == "SUCCESS", response["Reason"]
+
+
+def test_connect_read_write(monkeypatch):
+    monkeypatch.setattr(warmup, "dns", warmup.DNSCache(ttl=60))
+    connect_info = {"host": "localhost", "port": 5432, "dbname": "postgres", "user": "postgres", "password": "password"}
+    connection = warmup.connect_read_write(connect_info, 2)
+    assert warmup.is_read_write(connection)
+    connection.close()
+
+    # a server which does not accept writes, like a demoted writer, is resolved again
+    warmup.dns.entries["localhost"] = ("127.0.0.1", float("inf"))
+    with pytest.raises(psycopg2.OperationalError) as e:
+        warmup.connect_read_write(dict(connect_info, options="-c default_transaction_read_only=on"), 2)
+    assert "localhost is read-only" in str(e.value)
+    assert warmup.dns.entries.get("localhost", (None, 0))[1] != float("inf")